@@ -1,11 +1,29 @@
 import sys
-import json
+import re
+import functools
 import os
+import argparse
+import multiprocessing
+from types import SimpleNamespace
 import geopandas as gpd
-import folium
 import webbrowser
+import numpy as np
 import pandas as pd
+from branca.utilities import color_brewer
 from jinja2 import Template
+import cache
+from cache import cached, cached_frame, code_digest, content_key, file_digest, shapefile_digest
+from changes import CHANGE_PALETTE, CHANGES, change_column, compute_changes
+from classify import DIVERGING, FIXED, MAX_CLASSES, MIN_CLASSES, SCHEMES, class_count, classify
+from crosswalk import AREA_CRS, build_crosswalk, crosswalk_matrix, reaggregate
+from legends import legend_entry, legend_script, legend_symbols
+from geometry import LEVELS, PRECISION, city_boundary, simplified_levels, topology
+from layers import geometry_levels, shared_geometry_file, shared_geometry_script, topology_levels
+from panel import build_panel, panel_block, panel_columns, panel_values
+from redlining import HOLC_GRADES, REDLINING_INDICATORS, REDLINING_YEAR, redlining_measures
+from output import COMPRESSIONS, CompressedWriter, brotli
+from maps import is_precinct_column, layer_label, library_includes, map_layers, render_maps
+from tiles import TILE_ZOOMS, pmtiles_archive, render_tiles, tile_layer
 
 
 def resource_path(relative_path):
@@ -19,21 +37,138 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
-# Load the combined redline JSON
-with open('redlining/combined_nyc_redline.json', 'r') as f:
-    redline_data = json.load(f)
+def classes_argument(text):
+    # argparse only shows the message of an ArgumentTypeError
+    try:
+        return class_count(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from None
+
+
+parser = argparse.ArgumentParser(description='Build the NYC Disparity Mapper page')
+parser.add_argument('--geometry', choices=['shared', 'inline'], default='shared',
+                    help="'shared' writes each geometry once for the whole page, "
+                         "'inline' embeds it in every choropleth (folium default)")
+parser.add_argument('--format', choices=['topojson', 'geojson'], default='topojson',
+                    help="encoding of the shared geometry, 'topojson' stores shared borders once "
+                         "as quantized deltas and is decoded in the browser")
+parser.add_argument('--scheme', choices=SCHEMES, default='equal_interval',
+                    help='how overlay values are binned into colours')
+parser.add_argument('--classes', type=classes_argument, default=6,
+                    help=f'number of colour classes per overlay, {MIN_CLASSES} to {MAX_CLASSES}')
+parser.add_argument('--no-cache', action='store_true',
+                    help='rebuild everything instead of reusing artifacts stored in cache/')
+parser.add_argument('--cache-days', type=int, default=cache.MAX_AGE_DAYS,
+                    help='remove artifacts in cache/ no build has used for this many days '
+                         f'(default {cache.MAX_AGE_DAYS})')
+parser.add_argument('--layers', choices=['inline', 'lazy', 'tiles'], default='inline',
+                    help="'lazy' writes the overlay geometry to separate files fetched when an overlay is first "
+                         "shown, 'tiles' to a PMTiles archive of vector tiles with every indicator as attributes; "
+                         "the page then has to be served over HTTP")
+parser.add_argument('--renderer', choices=['canvas', 'svg'], default='canvas',
+                    help="how Leaflet draws the polygons, 'canvas' paints each pane on one canvas, "
+                         "'svg' makes a DOM node per polygon")
+parser.add_argument('--frame-times', action='store_true',
+                    help='log frame times to the browser console while a map pans or zooms')
+parser.add_argument('--boundary', choices=['modzcta', 'boroughs'], default='modzcta',
+                    help="source of the city outline, the union of the MODZCTA areas or of the borough boundaries")
+parser.add_argument('--workers', type=int, default=1,
+                    help='processes the map layers are rendered on, 0 for one per CPU')
+parser.add_argument('--years', type=lambda text: text.split(','),
+                    help='comma-separated census years shown side by side, e.g. 2011,2016,2022; '
+                         'defaults to the earliest and latest nyc-data-YYYY.csv found')
+parser.add_argument('--compare', type=lambda text: text.split(','),
+                    help="two years drawn on an extra map of the change between them, e.g. 2011,2022; "
+                         "no change map by default")
+parser.add_argument('--changes', type=lambda text: text.split(','), default=list(CHANGES),
+                    help=f"comma-separated kinds of change on the change map, of {', '.join(CHANGES)} (default all)")
+parser.add_argument('--indicators', type=lambda text: text.split(','),
+                    help="comma-separated overlays shown, by their name on the map, e.g. Population,Parks; "
+                         "defaults to all of them")
+parser.add_argument('--compress', type=lambda text: [name for name in text.split(',') if name], default=[],
+                    help="comma-separated compressed copies written next to the page and its layer files, "
+                         "of gz, br, e.g. gz,br for servers that send precompressed files")
+
+# Columns binned on fixed edges whatever --scheme is, e.g. {'Parks': [0, 5, 10, 20, 40, 80, 160]}
+fixed_breaks = {}
+
+# The census exports carry units in their headers; map them to the names used on the map
+census_columns = {
+    'Median Home Value (Dollars)': 'Median Home Value',
+    'Bachelors degree or higher (Older than 25)': 'Bachelors degree or higher',
+    'Median Houshold Income (More than 200000 Dollars)': 'Median Household Income',
+}
+
+
+def read_census_csv(path):
+    # utf-8-sig drops the byte order mark Excel leaves in front of 'ZCTA'
+    return pd.read_csv(path, encoding='utf-8-sig').rename(columns=census_columns)
+
+
+# Yearly inputs are found by name, adding nyc-data-YYYY.csv (and its stop and frisk file) adds a year
+census_pattern = re.compile(r'nyc-data-(\d{4})\.csv$')
+stop_frisk_pattern = re.compile(r'Stop_and_Frisk_Data_by_Precinct-(\d{4})\.csv$')
+
+
+def discover_years(folder, pattern):
+    """ {year: path} of the files in `folder` whose name matches `pattern`, oldest first """
+    folder = resource_path(folder)
+    paths = {}
+    for name in sorted(os.listdir(folder)):
+        match = pattern.match(name)
+        if match:
+            paths[match.group(1)] = os.path.join(folder, name)
+    return paths
+
+
+# The page and, with --layers lazy, the folder its layers are fetched from, with --layers tiles the archive
+output_path = 'nyc-disparity-map.html'
+data_dir = 'nyc-disparity-map-data'
+tiles_path = 'nyc-disparity-map.pmtiles'
+
+
+def write_layer_file(name, text, compressions=('gz',)):
+    # Servers that can send precompressed files (gzip_static and the like) pick up the compressed copies
+    os.makedirs(data_dir, exist_ok=True)
+    with CompressedWriter(os.path.join(data_dir, f'{name}.json'), compressions) as f:
+        f.write(text)
+    return f'{data_dir}/{name}.json'
+
+
+def write_tiles(inputs, workers=1):
+    # Vector tiles of the overlays carrying every indicator of their areas, cut again when the data or code change
+    def build():
+        layers = {
+            'zipcodes': tile_layer(inputs.zipcodes.geometry, {'modzcta': inputs.zipcodes['modzcta'],
+                                                              **panel_columns(inputs.panel, 'zipcodes')}),
+            'precincts': tile_layer(inputs.precincts.geometry, {'precinct': inputs.precincts['precinct'],
+                                                                **panel_columns(inputs.panel, 'precincts')}),
+            'redline': tile_layer(inputs.redline.geometry, {'grade': inputs.redline['grade']}, coverage=False),
+        }
+        bounds = np.array([frame.to_crs('EPSG:4326').total_bounds
+                           for frame in (inputs.zipcodes, inputs.precincts, inputs.redline)])
+        return pmtiles_archive(render_tiles(layers, TILE_ZOOMS, workers), layers,
+                               [*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)], TILE_ZOOMS,
+                               name='NYC Disparity Mapper')
+
+    key = content_key(inputs.source_digest, inputs.panel_key, inputs.zipcodes_digest, inputs.precincts_digest,
+                      inputs.redline_digest, list(TILE_ZOOMS))
+    archive = cached('tiles', key, build)
+    with open(tiles_path, 'wb') as f:
+        f.write(archive)
+    return tiles_path
+
+
+redline_path = 'redlining/combined_nyc_redline.json'
+precincts_path = resource_path('Police Precincts/geo_export_285d695e-252a-4bd6-b18d-ab8f95aa63f9.shp')
+zipcodes_path = resource_path('MODZCTA/geo_export_953eebb2-7abd-4e3f-9628-39d0237055a1.shp')
+boroughs_path = resource_path('Borough Boundaries/geo_export_2dc5263e-319c-4844-8015-68ea09bf7458.shp')
 
-# Use the resource_path function for all your data files
-precincts = gpd.read_file(resource_path('Police Precincts/geo_export_285d695e-252a-4bd6-b18d-ab8f95aa63f9.shp'))
-data_2011 = pd.read_csv(resource_path('nyc-data-2011.csv'))
-data_2016 = pd.read_csv(resource_path('nyc-data-2016.csv'))
-data_2022 = pd.read_csv(resource_path('nyc-data-2022.csv'))
-zipcodes = gpd.read_file(resource_path('MODZCTA/geo_export_953eebb2-7abd-4e3f-9628-39d0237055a1.shp'))
 
-# Load Stop and Frisk data
-stop_frisk_2011 = pd.read_csv('stopandfrisk/Stop_and_Frisk_Data_by_Precinct-2011.csv')
-stop_frisk_2016 = pd.read_csv('stopandfrisk/Stop_and_Frisk_Data_by_Precinct-2016.csv')
-stop_frisk_2022 = pd.read_csv('stopandfrisk/Stop_and_Frisk_Data_by_Precinct-2022.csv')
+def read_geodata(path, digest):
+    # Sources are parsed once into a columnar cache, later runs memory-map it instead
+    name = os.path.basename(os.path.dirname(path)).replace(' ', '-').lower()
+    return cached_frame(f'source-{name}', content_key(digest), lambda: gpd.read_file(path))
 
 
 # Function to clean and convert 'Precinct' column
@@ -47,166 +182,99 @@ def clean_precinct(df):
     return df
 
 
-# Clean and convert 'Precinct' column for all datasets
-stop_frisk_2011 = clean_precinct(stop_frisk_2011)
-stop_frisk_2016 = clean_precinct(stop_frisk_2016)
-stop_frisk_2022 = clean_precinct(stop_frisk_2022)
-
-# Convert 'precinct' column in precincts to integer
-precincts['precinct'] = pd.to_numeric(precincts['precinct'], errors='coerce').astype('Int64')
-
-# Merge Stop and Frisk data with precincts
-precincts = precincts.merge(stop_frisk_2011, left_on='precinct', right_on='Precinct', how='left')
-precincts = precincts.merge(stop_frisk_2016, left_on='precinct', right_on='Precinct', how='left',
-                            suffixes=('_2011', '_2016'))
-precincts = precincts.merge(stop_frisk_2022, left_on='precinct', right_on='Precinct', how='left')
-precincts = precincts.rename(columns={'Black Stopped Rate': 'Black Stopped Rate_2022'})
-
-# Convert 'modzcta' in zipcodes and 'ZCTA' in data to strings
-zipcodes['modzcta'] = zipcodes['modzcta'].astype(str)
-data_2011['ZCTA'] = data_2011['ZCTA'].astype(str)
-data_2016['ZCTA'] = data_2016['ZCTA'].astype(str)
-data_2022['ZCTA'] = data_2022['ZCTA'].astype(str)
-
-# Merge the zipcode shapefile with your data
-zipcodes_2011 = zipcodes.merge(data_2011, left_on='modzcta', right_on='ZCTA', how='left')
-zipcodes_2016 = zipcodes.merge(data_2016, left_on='modzcta', right_on='ZCTA', how='left')
-zipcodes_2022 = zipcodes.merge(data_2022, left_on='modzcta', right_on='ZCTA', how='left')
-
-
-# Function to create a folium map and return its HTML
-def create_map_html(columns, zipcodes_data, precincts_data, year):
-    # Create a base map centered on NYC with white background
-    m = folium.Map(
-        location=[40.7128, -74.0060],
-        zoom_start=11,
-        tiles=None,
-        control_scale=True,
-        width="50vw",
-        height="100vh"
-    )
-
-    # Set map size to 100%
-    m._size = ("50vw", "100vh")
-
-    folium.TileLayer(
-        'cartodbpositron',
-        name='Light Map',
-        overlay=False,
-        control=False
-    ).add_to(m)
-
-    # Create a mask for the five boroughs
-    nyc_boundary = zipcodes_data.dissolve()
-
-    # Add the mask to the map
-    folium.GeoJson(
-        nyc_boundary,
-        style_function=lambda x: {
-            'fillColor': 'white',
-            'color': 'white',
-            'weight': 1,
-            'fillOpacity': 0,
-        },
-        overlay=False,
-        control=False
-    ).add_to(m)
-
-    # Create a custom pane for Redlining Overlay
-    redlining_pane = folium.map.CustomPane("redliningPane", z_index=650)
-    m.add_child(redlining_pane)
-
-    # Add the redline JSON data as an overlay to the custom pane
-    folium.GeoJson(
-        redline_data,
-        name='Redlining Overlay',
-        style_function=lambda feature: {
-            'fillColor': feature['properties'].get('fill', '#ff0000'),
-            'color': 'black',
-            'weight': 0,
-            'fillOpacity': 0.6,
-        },
-        pane="redliningPane",  # Assign to the custom pane
-        show=False
-    ).add_to(m)
-
-    # Function to create a choropleth layer
-    def create_choropleth(column, data, is_precinct=False):
-
-        if is_precinct:
-            geo_data = precincts_data
-            key_on = 'feature.properties.precinct'
-            if column.startswith('Black Stopped Rate'):
-                layer_name = f"Black Stopped Rate"
-            elif column == 'Public Schools':
-                layer_name = f"Public Schools"
-            elif column == 'Parks':
-                layer_name = f"Parks"
-            else:
-                layer_name = f"{column.replace('_', ' ').title()}"
-        else:
-            geo_data = zipcodes_data
-            key_on = 'feature.properties.modzcta'
-            layer_name = f"{column.replace('_', ' ').title()}"
-
-        choro = folium.Choropleth(
-            geo_data=geo_data,
-            name=layer_name,
-            data=data,
-            columns=['ZCTA' if not is_precinct else 'Precinct', column],
-            key_on=key_on,
-            fill_color='YlOrRd',
-            fill_opacity=0.5,
-            line_opacity=0,
-            overlay=False,
-            show=False  # Ensure the overlay is turned off by default
-        ).add_to(m)
-
-        # Remove the color map added by folium's Choropleth
-        for key in choro._children:
-            if key.startswith('color_map'):
-                del (choro._children[key])
-
-        return choro
-
-    # Create and add choropleth layers
-    for column in columns:
-        if column.startswith('Black Stopped Rate') or column in ['Public Schools', 'Parks']:
-            create_choropleth(column, precincts_data, is_precinct=True).add_to(m)
-        else:
-            create_choropleth(column, zipcodes_data).add_to(m)
-
-    # Add layer control with exclusive groups for choropleth layers
-    folium.LayerControl(collapsed=False, exclusiveGroups=columns).add_to(m)
-
-    # Get the HTML but modify it to use relative sizing
-    html = m.get_root().render()
-    # Remove any fixed width/height settings that might be injected
-    html = html.replace('width: 100.0%', 'width: 50vw')
-    html = html.replace('height: 100.0%', 'height: 100vh')
-    return html
+# Indicators each stop and frisk file has per precinct, the stop rate as 'Black Stopped Rate_YYYY'
+stop_frisk_indicators = ['Black Stopped Rate', 'Public Schools', 'Parks']
+
+
+# Rates and medians are averaged, not summed, when moved onto the other geography
+intensive_indicators = {'Median Home Value', 'Black Stopped Rate'}
+
+
+# Function to read every year of census and Stop and Frisk data into one panel, without geometry.
+# Each indicator is also estimated on the other geography through the crosswalk, so any two can be
+# compared on the same units
+def load_panel(census_paths, stop_frisk_paths, zipcode_ids, precinct_ids, crosswalk, redlining):
+    tables = []
+    for year, path in census_paths.items():
+        data = read_census_csv(path)
+        # Convert 'ZCTA' to strings like 'modzcta' in the zipcodes
+        data['ZCTA'] = data['ZCTA'].astype(str)
+        tables.append(('zipcodes', year, data.set_index('ZCTA'), base_columns))
+    for year, path in stop_frisk_paths.items():
+        data = clean_precinct(pd.read_csv(path)).rename(columns={f'Black Stopped Rate_{year}': 'Black Stopped Rate'})
+        tables.append(('precincts', year, data.set_index('Precinct'), stop_frisk_indicators))
+
+    # Counts are split by area, rates and medians averaged by the population of each piece
+    geographies = {'zipcodes': ('zipcode', zipcode_ids), 'precincts': ('precinct', precinct_ids)}
+    sizes = {'zipcode': len(zipcode_ids), 'precinct': len(precinct_ids)}
+    matrices = {(source, intensive): crosswalk_matrix(crosswalk, source, target, sizes,
+                                                      'population' if intensive else 'area', intensive)
+                for source, target in (('zipcode', 'precinct'), ('precinct', 'zipcode'))
+                for intensive in (False, True)}
 
+    blocks = []
+    for geography, year, data, indicators in tables:
+        source, ids = geographies[geography]
+        values = data.reindex(pd.Index(ids))[indicators].to_numpy(dtype=float, na_value=np.nan)
+        blocks.append(panel_block(geography, ids, int(year), indicators, values))
+
+        target = 'precincts' if geography == 'zipcodes' else 'zipcodes'
+        for intensive in (False, True):
+            moved = [i for i, indicator in enumerate(indicators) if (indicator in intensive_indicators) == intensive]
+            if moved:
+                blocks.append(panel_block(target, geographies[target][1], int(year), [indicators[i] for i in moved],
+                                          reaggregate(matrices[source, intensive], values[:, moved], intensive)))
+
+    # The redlining measures are computed on both geographies, there is nothing to move
+    for geography, values in redlining.items():
+        blocks.append(panel_block(geography, geographies[geography][1], REDLINING_YEAR, REDLINING_INDICATORS, values))
+    return build_panel(blocks)
 
 
 # Define columns for the maps
 base_columns = ['Median Home Value', "Bachelors degree or higher", 'Population', 'White',
                 'Black or African American', 'Asian', 'Median Household Income']
 
-# Define year-specific columns
-columns_2011 = base_columns + ['Black Stopped Rate_2011', 'Public Schools', 'Parks']
-columns_2016 = base_columns + ['Black Stopped Rate_2016', 'Public Schools', 'Parks']
-columns_2022 = base_columns + ['Black Stopped Rate_2022', 'Public Schools', 'Parks']
 
-# Create the maps' HTML
-map_html_2011 = create_map_html(columns_2011, zipcodes_2011, precincts, '2011')
-map_html_2016 = create_map_html(columns_2016, zipcodes_2016, precincts, '2016')
-map_html_2022 = create_map_html(columns_2022, zipcodes_2022, precincts, '2022')
+# Define year-specific columns, stop and frisk only for the years it was published
+def columns_for_year(year, stop_frisk_years):
+    stop_rate = [f'Black Stopped Rate_{year}'] if year in stop_frisk_years else []
+    facilities = ['Public Schools', 'Parks'] if stop_frisk_years else []
+    return base_columns + stop_rate + facilities + REDLINING_INDICATORS
+
+
+# Where in the panel a layer of a year's map reads its values
+def layer_source(year, column, facilities_year):
+    if column.startswith('Black Stopped Rate'):
+        return 'precincts', 'Black Stopped Rate', int(year)
+    if is_precinct_column(column):
+        # Schools and parks are mapped from the latest file for every year
+        return 'precincts', column, int(facilities_year)
+    if column in REDLINING_INDICATORS:
+        # The HOLC maps are the same whatever the year
+        return 'zipcodes', column, REDLINING_YEAR
+    return 'zipcodes', column, int(year)
+
+
+# Legend titles that differ from the layer's name
+legend_titles = {
+    'Bachelors Degree Or Higher': "Bachelor's Degree or Higher",
+    'Black Or African American': 'Black',
+    'Black Stopped Rate': 'Black Stopped Rate (%)',
+    'Median Household Income': 'Income (Above $200000)',
+    'Parks': 'Number of Parks',
+    **{f'Grade {grade} Share': f'Area Graded {grade} by the HOLC (%)' for grade in HOLC_GRADES},
+    'Redlining Score': 'Redlining Score (1 = All A, 4 = All D)',
+}
+
 
 # Template for the combined HTML file
 combined_html_template = """
 <!DOCTYPE html>
 <html>
 <head>
+    {{ library_includes_html }}
+    {{ shared_geometry_html }}
     <style>
         body, html {
             margin: 0;
@@ -217,7 +285,7 @@ combined_html_template = """
         }
 
         .map-container {
-            width: 50vw;
+            width: {{ map_width }};
             height: 100vh;
             position: relative;
         }
@@ -299,7 +367,7 @@ combined_html_template = """
     }
 
         .leaflet-container {
-            width: 50vw !important;
+            width: {{ map_width }} !important;
             height: 100vh !important;
         }
 
@@ -326,6 +394,19 @@ combined_html_template = """
         .help-button:hover {
             background-color: #0056b3;
         }
+        .link-toggle {
+            position: absolute;
+            bottom: 70px;
+            right: 20px;
+            z-index: 1000;
+            background-color: white;
+            padding: 5px 10px;
+            border-radius: 4px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.2);
+            font-family: Arial, sans-serif;
+            font-size: 14px;
+            cursor: pointer;
+        }
 
         .help-modal {
             display: none;
@@ -376,60 +457,38 @@ combined_html_template = """
     </style>
 </head>
 <body>
+    {{ legend_symbols_html }}
+    {%- for year, map_html in maps.items() %}
     <div class="map-container">
         <div class="header-container">
-            <span class="year-label">2011</span>
-            <span class="active-layer" id="activeLayer2011">No overlay selected</span>
-        </div>
-        <div class="legend-container" id="legend2011">
-            <strong>Legend</strong>
-        </div>
-        <div class="redlining-legend-container" id="redliningLegend2011">
-            <strong> Redlining </strong>
-            <svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-            <defs>
-                <linearGradient id="branca-gradient-redlining-2011-inline" x1="0%" y1="0%" x2="100%" y2="0%">
-                    <stop offset="0%" style="stop-color: #b8d1af;" />
-                    <stop offset="33%" style="stop-color: #b2cfd3;" />
-                    <stop offset="66%" style="stop-color: #fdfd7c;" />
-                    <stop offset="100%" style="stop-color: #eabfc3;" />
-                </linearGradient>
-            </defs>
-            <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-redlining-2011-inline)" stroke="black" stroke-width="1" />
-            <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Least</text>
-            <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Most</text>
-            <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Amount of Redlining</text>
-        </svg>
-        </div>
-        <div id="map2011">{{ map_html_2011 }}</div>
-    </div>
-    <div class="map-container">
-        <div class="header-container">
-            <span class="year-label">2022</span>
-            <span class="active-layer" id="activeLayer2022">No overlay selected</span>
+            <span class="year-label">{{ year }}</span>
+            <span class="active-layer" id="activeLayer{{ year }}">No overlay selected</span>
         </div>
-        <div class="legend-container" id="legend2022">
+        <div class="legend-container" id="legend{{ year }}">
             <strong>Legend</strong>
         </div>
-        <div class="redlining-legend-container" id="redliningLegend2022">
+        <div class="redlining-legend-container" id="redliningLegend{{ year }}">
             <strong> Redlining </strong>
             <svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
             <defs>
-                <linearGradient id="branca-gradient-redlining-2022-inline" x1="0%" y1="0%" x2="100%" y2="0%">
+                <linearGradient id="branca-gradient-redlining-{{ year }}-inline" x1="0%" y1="0%" x2="100%" y2="0%">
                     <stop offset="0%" style="stop-color: #b8d1af;" />
                     <stop offset="33%" style="stop-color: #b2cfd3;" />
                     <stop offset="66%" style="stop-color: #fdfd7c;" />
                     <stop offset="100%" style="stop-color: #eabfc3;" />
                 </linearGradient>
             </defs>
-            <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-redlining-2022-inline)" stroke="black" stroke-width="1" />
+            <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-redlining-{{ year }}-inline)" stroke="black" stroke-width="1" />
             <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Least</text>
             <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Most</text>
             <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Amount of Redlining</text>
         </svg>
         </div>
-        <div id="map2022">{{ map_html_2022 }}</div>
+        <div id="map{{ year }}">{{ map_html }}</div>
     </div>
+    {%- endfor %}
+    <!-- Linked View Toggle -->
+    <label class="link-toggle"><input type="checkbox" id="linkMaps" checked> Link maps</label>
     <!-- Help Button -->
     <button class="help-button" id="helpButton">Help</button>
 
@@ -471,472 +530,110 @@ combined_html_template = """
         });
     </script>
     <script>
-    function setupMapListeners() {
-        const svgTemplates = {
-        asian2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-asian-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-asian-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">0</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">28087</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">56173</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Asian</text>
-    </svg>`,
-        
-        bachelors2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-    <defs>
-        <linearGradient id="branca-gradient-bachelors-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-            <stop offset="0%" style="stop-color: #fdfdd5;" />
-            <stop offset="25%" style="stop-color: #fceab7;" />
-            <stop offset="50%" style="stop-color: #edc794;" />
-            <stop offset="75%" style="stop-color: #f59b8c;" />
-            <stop offset="100%" style="stop-color: #dc7d8f;" />
-        </linearGradient>
-    </defs>
-    <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-bachelors-2011)" stroke="black" stroke-width="1" />
-    <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">585</text>
-    <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">23941</text>
-    <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">47297</text>
-    <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Bachelor's Degree or Higher</text>
-</svg>`,
-
-black2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-black-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-black-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">4</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">39874</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">79744</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Black</text>
-    </svg>`,
-
-    blackstopped2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-blackstopped-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-blackstopped-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">5</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">48</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">91</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Black Stopped Rate (%)</text>
-    </svg>`,
-
-    homevalue2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-homevalue-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-homevalue-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">100000</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">500000</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">1000000</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Median Home Value</text>
-    </svg>`,
-
-    income2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-income-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-income-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">0</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">4516</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">9032</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Income (Above $200000)</text>
-    </svg>`,
-    
-    parks2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-parks-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-parks-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">1</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">11</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">21</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Number of Parks</text>
-    </svg>`,
-
-    population2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-population-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-population-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">2604</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">53003</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">103401</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Population</text>
-    </svg>`,
-
-    redlining2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-redlining-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #b8d1af;" />
-                <stop offset="33%" style="stop-color: #b2cfd3;" />
-                <stop offset="66%" style="stop-color: #fdfd7c;" />
-                <stop offset="100%" style="stop-color: #eabfc3;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-redlining-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Least</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Most</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Amount of Redlining</text>
-    </svg>`,
-
-    schools2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-schools-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-schools-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">4</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">28</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">52</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Public Schools</text>
-    </svg>`,
-
-    white2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-white-2011" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-white-2011)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">484</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">39661</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">78838</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">White</text>
-    </svg>`,
-    
-    asian2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-asian-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-asian-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">44</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">28897</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">57749</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Asian</text>
-    </svg>`,
-
-    bachelors2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-bachelors-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-bachelors-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">1026</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">32514</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">49094</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Bachelor's Degree or Higher</text>
-    </svg>`,
-
-    black2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-black-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-black-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">9</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">40809</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">81608</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Black</text>
-    </svg>`,
-
-    blackstopped2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-blackstopped-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-blackstopped-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">10</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">52</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">93</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Black Stopped Rate (%)</text>
-    </svg>`,
-    
-    homevalue2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-homevalue-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-homevalue-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">100000</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">500000</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">2000000</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Median Home Value</text>
-    </svg>`,
-
-    income2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-income-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-income-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">116</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">7093</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">14069</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Income (Above $200000)</text>
-    </svg>`,
-
-    parks2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-parks-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-parks-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">1</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">11</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">21</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Number of Parks</text>
-    </svg>`,
-
-    population2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-population-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-population-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">3736</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">58243</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">112750</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Population</text>
-    </svg>`,
-
-    redlining2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-redlining-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #b8d1af;" />
-                <stop offset="33%" style="stop-color: #b2cfd3;" />
-                <stop offset="66%" style="stop-color: #fdfd7c;" />
-                <stop offset="100%" style="stop-color: #eabfc3;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-redlining-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Least</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Most</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Amount of Redlining</text>
-    </svg>`,
-
-    schools2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-schools-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-schools-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">4</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">28</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">52</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">Public Schools</text>
-    </svg>`,
-
-    white2022: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
-        <defs>
-            <linearGradient id="branca-gradient-white-2022" x1="0%" y1="0%" x2="100%" y2="0%">
-                <stop offset="0%" style="stop-color: #fdfdd5;" />
-                <stop offset="25%" style="stop-color: #fceab7;" />
-                <stop offset="50%" style="stop-color: #edc794;" />
-                <stop offset="75%" style="stop-color: #f59b8c;" />
-                <stop offset="100%" style="stop-color: #dc7d8f;" />
-            </linearGradient>
-        </defs>
-        <rect x="25" y="20" width="200" height="10" fill="url(#branca-gradient-white-2022)" stroke="black" stroke-width="1" />
-        <text x="25" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">734</text>
-        <text x="125" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">32514</text>
-        <text x="225" y="15" font-family="Arial" font-size="12" text-anchor="middle" fill="black">64293</text>
-        <text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">White</text>
-    </svg>`
-    };
-        
-        document.querySelectorAll('.map-container').forEach(container => {
-            const year = container.querySelector('.year-label').textContent;
-            const activeLayerElement = container.querySelector('.active-layer');
-            const legendContainer = container.querySelector('.legend-container');
-            const redliningLegendContainer = container.querySelector(`#redliningLegend${year}`);
-
-            // Define the mapping between layers and their SVG templates
-            const svgMapping = {
-                2011: {
-                    'Asian': svgTemplates.asian2011,
-                    'Bachelors Degree Or Higher': svgTemplates.bachelors2011,
-                    'Black Or African American': svgTemplates.black2011,
-                    'Black Stopped Rate': svgTemplates.blackstopped2011,
-                    'Median Home Value': svgTemplates.homevalue2011,
-                    'Median Household Income': svgTemplates.income2011,
-                    'Parks': svgTemplates.parks2011,
-                    'Population': svgTemplates.population2011,
-                    'Public Schools': svgTemplates.schools2011,
-                    'White': svgTemplates.white2011
-                },
-                2022: {
-                    'Asian': svgTemplates.asian2022,
-                    'Bachelors Degree Or Higher': svgTemplates.bachelors2022,
-                    'Black Or African American': svgTemplates.black2022,
-                    'Black Stopped Rate': svgTemplates.blackstopped2022,
-                    'Median Home Value': svgTemplates.homevalue2022,
-                    'Median Household Income': svgTemplates.income2022,
-                    'Parks': svgTemplates.parks2022,
-                    'Population': svgTemplates.population2022,
-                    'Public Schools': svgTemplates.schools2022,
-                    'White': svgTemplates.white2022
-                }
-            };
-
-            // Keep track of active overlays
-            const activeOverlays = new Set();
-
-            // Function to refresh the legend based on active overlays
-            function refreshLegend() {
-                let legendHtml = `<strong>Legend</strong>`;
-                activeOverlays.forEach(overlay => {
-                    const svgContent = svgMapping[year]?.[overlay];
-                    if (svgContent) {
-                        legendHtml += `<br>${svgContent}`;
+        // Keep both year maps on the same view while 'Link maps' is ticked. A gesture
+        // moving one map updates the other once per animation frame, and the moves made
+        // here don't echo back to the map they came from.
+        function linkMaps(maps, toggle) {
+            let source = null;
+            let syncing = false;
+
+            function follow() {
+                const center = source.getCenter();
+                const zoom = source.getZoom();
+                syncing = true;
+                maps.forEach(map => {
+                    if (map !== source) {
+                        map.setView(center, zoom, { animate: false });
                     }
                 });
-                legendContainer.innerHTML = legendHtml;
+                syncing = false;
+                source = null;
             }
 
-            // Function to toggle the Redlining Legend
-            function toggleRedliningLegend(visible) {
-                redliningLegendContainer.style.display = visible ? 'block' : 'none';
+            function schedule(map) {
+                if (source === null) {
+                    requestAnimationFrame(follow);
+                }
+                source = map;
             }
 
-            // Handle radio button changes
-            const radioInputs = container.querySelectorAll('.leaflet-control-layers-selector[type="radio"]');
-            radioInputs.forEach(input => {
-                input.addEventListener('change', function () {
-                    if (this.checked) {
-                        const labelText = this.nextElementSibling.textContent.trim();
-                        activeOverlays.clear();
-                        activeOverlays.add(labelText);
-                        activeLayerElement.textContent = labelText;
-                        refreshLegend();
+            maps.forEach(map => {
+                map.on('move zoom', () => {
+                    if (!syncing && toggle.checked) {
+                        schedule(map);
                     }
                 });
             });
 
-            // Handle checkbox changes
-            const checkboxInputs = container.querySelectorAll('.leaflet-control-layers-selector[type="checkbox"]');
-            checkboxInputs.forEach(input => {
-                input.addEventListener('change', function () {
-                    const labelText = this.nextElementSibling.textContent.trim();
-                    
-                    if (this.checked) {
-                        activeOverlays.add(labelText);
-                    } else {
-                        activeOverlays.delete(labelText);
-                    }
+            // Ticking the box again lines the other maps up with the first one
+            toggle.addEventListener('change', () => {
+                if (toggle.checked) {
+                    schedule(maps[0]);
+                }
+            });
+        }
 
-                    if (labelText === 'Redlining Overlay') {
-                        toggleRedliningLegend(this.checked);
-                    }
+        linkMaps(Array.from(document.querySelectorAll('.folium-map'), element => window[element.id]),
+                 document.getElementById('linkMaps'));
+    </script>
+    <script>
+    {{ legend_script }}
+
+    // Keep each map's header and legends in step with its layer control, driven by the
+    // events Leaflet fires when an entry in the control is picked
+    document.querySelectorAll('.map-container').forEach(container => {
+        const year = container.querySelector('.year-label').textContent;
+        const map = window[container.querySelector('.folium-map').id];
+        const activeLayerElement = container.querySelector('.active-layer');
+        const legendContainer = container.querySelector('.legend-container');
+        const redliningLegendContainer = container.querySelector(`#redliningLegend${year}`);
+
+        // Keep track of active overlays
+        const activeOverlays = new Set();
+
+        // Function to refresh the legend based on active overlays
+        function refreshLegend() {
+            let legendHtml = `<strong>Legend</strong>`;
+            activeOverlays.forEach(overlay => {
+                const entry = legendData[year]?.[overlay];
+                if (entry) {
+                    legendHtml += `<br>${legendSvg(entry)}`;
+                }
+            });
+            legendContainer.innerHTML = legendHtml;
+        }
 
-                    refreshLegend();
-                });
+        // Function to toggle the Redlining Legend
+        function toggleRedliningLegend(visible) {
+            redliningLegendContainer.style.display = visible ? 'block' : 'none';
+        }
+
+        // One listener per map for every entry of its layer control
+        map.whenReady(() => {
+            // A long layer control, like the change map's, pushes the legends down instead of running under them
+            const control = container.querySelector('.leaflet-control-layers');
+            const below = control.getBoundingClientRect().bottom - container.getBoundingClientRect().top + 10;
+            legendContainer.style.top = `${Math.max(260, below)}px`;
+            redliningLegendContainer.style.top = `${Math.max(350, below + 90)}px`;
+
+            map.on('baselayerchange overlayadd overlayremove', event => {
+                const labelText = event.name.trim();
+                if (event.type === 'baselayerchange') {
+                    // Radio buttons, one overlay at a time
+                    activeOverlays.clear();
+                    activeOverlays.add(labelText);
+                    activeLayerElement.textContent = labelText;
+                } else if (event.type === 'overlayadd') {
+                    activeOverlays.add(labelText);
+                } else {
+                    activeOverlays.delete(labelText);
+                }
+                if (labelText === 'Redlining Overlay') {
+                    toggleRedliningLegend(event.type === 'overlayadd');
+                }
+                refreshLegend();
             });
         });
-    }
-
-    // Wait for Leaflet controls to be fully loaded
-    window.addEventListener('load', () => {
-        setTimeout(setupMapListeners, 1000);
     });
 </script>
 
@@ -945,12 +642,303 @@ black2011: `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" styl
 """
 
 # Render the combined HTML
-template = Template(combined_html_template)
-combined_html = template.render(map_html_2011=map_html_2011, map_html_2016=map_html_2016, map_html_2022=map_html_2022)
 
-# Save the combined HTML file
-with open('nyc-disparity-map.html', 'w') as f:
-    f.write(combined_html)
 
-# Automatically open the combined HTML file in the default web browser
-webbrowser.open('file://' + os.path.join(os.getcwd(), 'nyc-disparity-map.html'))
+def load_inputs():
+    """ The geometry and the panel of every year found, with the digests of the files they come from """
+    census_paths = discover_years('.', census_pattern)
+    stop_frisk_paths = discover_years('stopandfrisk', stop_frisk_pattern)
+
+    # Every build artifact is keyed on the contents of the files it is made from
+    precincts_digest = shapefile_digest(precincts_path)
+    zipcodes_digest = shapefile_digest(zipcodes_path)
+    redline_digest = file_digest(redline_path)
+    code_folder = os.path.dirname(os.path.abspath(__file__))
+    source_digest = code_digest([os.path.join(code_folder, module)
+                                 for module in ('base.py', 'changes.py', 'classify.py', 'crosswalk.py', 'geometry.py',
+                                                'layers.py', 'legends.py', 'maps.py', 'panel.py', 'redlining.py',
+                                                'tiles.py')])
+
+    # Load the combined redline JSON
+    redline = read_geodata(redline_path, redline_digest)
+
+    # Geometry is read once per geography, the panel only holds ids and values
+    zipcodes = read_geodata(zipcodes_path, zipcodes_digest)
+    zipcodes['modzcta'] = zipcodes['modzcta'].astype(str)
+    precincts = read_geodata(precincts_path, precincts_digest)
+    precincts['precinct'] = pd.to_numeric(precincts['precinct'], errors='coerce').astype('Int64')
+
+    # How the ZCTAs and precincts overlap, intersected once per pair of shapefiles
+    crosswalk_key = content_key(zipcodes_digest, precincts_digest, AREA_CRS,
+                                code_digest([os.path.join(code_folder, 'crosswalk.py')]))
+    crosswalk = cached('crosswalk', crosswalk_key,
+                       lambda: build_crosswalk(zipcodes.geometry, precincts.geometry, zipcodes['pop_est']))
+
+    # Share of every ZCTA and precinct in each HOLC grade, intersected once per set of shapefiles
+    redlining_key = content_key(zipcodes_digest, precincts_digest, redline_digest, AREA_CRS, HOLC_GRADES,
+                                code_digest([os.path.join(code_folder, module)
+                                             for module in ('redlining.py', 'crosswalk.py')]))
+    redlining = cached('redlining', redlining_key, lambda: {
+        geography: redlining_measures(frame.geometry, redline.geometry, redline['grade'])
+        for geography, frame in (('zipcodes', zipcodes), ('precincts', precincts))})
+
+    # Every year found is read into one panel, it only needs rebuilding when a data file changes
+    panel_key = content_key(source_digest, crosswalk_key, redlining_key, census_columns,
+                            {year: file_digest(path) for year, path in census_paths.items()},
+                            {year: file_digest(path) for year, path in stop_frisk_paths.items()})
+    panel = cached('panel', panel_key, lambda: load_panel(census_paths, stop_frisk_paths, zipcodes['modzcta'],
+                                                           precincts['precinct'], crosswalk, redlining))
+
+    return SimpleNamespace(census_paths=census_paths, stop_frisk_paths=stop_frisk_paths,
+                           precincts_digest=precincts_digest, zipcodes_digest=zipcodes_digest,
+                           redline_digest=redline_digest, source_digest=source_digest, panel_key=panel_key,
+                           redline=redline, zipcodes=zipcodes, precincts=precincts, crosswalk=crosswalk, panel=panel)
+
+
+def build_page(args, inputs, workers=1, store=cache, write_layer=write_layer_file):
+    """ HTML of the page described by `args`, parsed by `parser`, drawn from `inputs` of load_inputs, in chunks.
+
+    Artifacts are kept in `store`, anything with cache's `cached` and
+    `is_cached`. Layers loaded lazily are handed to `write_layer(name, text)`,
+    which returns the URL the page fetches them from. Raises ValueError for
+    years, changes or indicators the data doesn't have.
+    """
+    # Only the years on the page are rendered
+    census_paths, stop_frisk_paths, panel = inputs.census_paths, inputs.stop_frisk_paths, inputs.panel
+    zipcodes, precincts, redline = inputs.zipcodes, inputs.precincts, inputs.redline
+    if not census_paths:
+        raise ValueError("no nyc-data-YYYY.csv found")
+    years = args.years or sorted({min(census_paths), max(census_paths)})
+    missing = [year for year in years if year not in census_paths]
+    if missing:
+        raise ValueError(f"no census data for {', '.join(missing)}, found {', '.join(census_paths)}")
+
+    # A map of the change between two years follows the year maps when asked for
+    compare = args.compare
+    if compare in (None, ['none']):
+        compare = None
+    elif len(compare) != 2 or compare[0] == compare[1] or any(year not in census_paths for year in compare):
+        raise ValueError(f"--compare takes two different years of {', '.join(census_paths)}")
+    unknown = [kind for kind in args.changes if kind not in CHANGES]
+    if unknown:
+        raise ValueError(f"unknown change {', '.join(unknown)}, expected some of {', '.join(CHANGES)}")
+
+    # Indicators are picked by their name on the layer control, in any case
+    labels = {layer_label(column).lower(): layer_label(column)
+              for year in years for column in columns_for_year(year, stop_frisk_paths)}
+    indicators = {indicator.strip().lower() for indicator in args.indicators or labels}
+    unknown = sorted(indicators - set(labels))
+    if unknown:
+        raise ValueError(f"unknown indicator {', '.join(unknown)}, expected some of {', '.join(labels.values())}")
+
+    def shown(column):
+        return layer_label(column).lower() in indicators
+
+    boundary_path = boroughs_path if args.boundary == 'boroughs' else zipcodes_path
+    boundary_digest = shapefile_digest(boundary_path)
+
+    # Each shown layer's values, in the row order of its geometry
+    stop_frisk_years = [year for year in years if year in stop_frisk_paths]
+    facilities_year = max(stop_frisk_paths) if stop_frisk_paths else None
+    year_columns = {year: [column for column in columns_for_year(year, stop_frisk_years) if shown(column)]
+                    for year in years}
+    layer_values = {year: {column: panel_values(panel, *layer_source(year, column, facilities_year))
+                           for column in columns}
+                    for year, columns in year_columns.items()}
+    map_palettes = {year: 'YlOrRd' for year in years}
+
+    # The change map's layers, every indicator with values in both years changes in one pass per geography
+    change_map = None
+    if compare:
+        before, after = compare
+        change_map = f'{before}-{after}'
+        sources = {'zipcodes': [], 'precincts': []}
+        for column in filter(shown, columns_for_year(after, stop_frisk_paths)):
+            geography, indicator, after_year = layer_source(after, column, facilities_year)
+            before_year = layer_source(before, column, facilities_year)[2]
+            if before_year != after_year and (geography, indicator, before_year) in panel.index:
+                sources[geography].append((indicator, before_year, after_year))
+
+        year_columns[change_map] = []
+        layer_values[change_map] = {}
+        for geography, changed in sources.items():
+            if not changed:
+                continue
+            changes = compute_changes(
+                np.column_stack([panel_values(panel, geography, indicator, year) for indicator, year, _ in changed]),
+                np.column_stack([panel_values(panel, geography, indicator, year) for indicator, _, year in changed]),
+                args.changes)
+            for kind in args.changes:
+                for i, (indicator, _, _) in enumerate(changed):
+                    column = change_column(indicator, kind)
+                    year_columns[change_map].append(column)
+                    layer_values[change_map][column] = changes[kind][:, i]
+        map_palettes[change_map] = CHANGE_PALETTE
+
+    # Classify every overlay of every year in one pass, one array per geography with a
+    # row per feature and a column per (year, overlay)
+    layer_classes = {year: {} for year in year_columns}
+    for is_precinct in (False, True):
+        layers = [(year, column) for year, columns in year_columns.items()
+                  for column in columns if is_precinct_column(column) == is_precinct]
+        if not layers:
+            continue
+        values = np.column_stack([layer_values[year][column] for year, column in layers])
+
+        # Columns with fixed edges are binned on their own, everything else in one call per scheme.
+        # Changes are binned symmetrically around zero
+        edges = [None] * len(layers)
+        codes = np.empty(values.shape, dtype=np.uint8)
+        for scheme in (args.scheme, DIVERGING):
+            binned = [i for i, (year, column) in enumerate(layers)
+                      if column not in fixed_breaks and (year == change_map) == (scheme == DIVERGING)]
+            if binned:
+                scheme_edges, codes[:, binned] = classify(values[:, binned], scheme, args.classes)
+                for i, column_edges in zip(binned, scheme_edges):
+                    edges[i] = column_edges
+        for i, (_, column) in enumerate(layers):
+            if column in fixed_breaks:
+                column_edges, column_codes = classify(values[:, i], FIXED, breaks=fixed_breaks[column])
+                edges[i], codes[:, i] = column_edges[0], column_codes[:, 0]
+
+        for i, (year, column) in enumerate(layers):
+            layer_classes[year][column] = (edges[i], codes[:, i])
+
+    # Legends are drawn from the same edges that colour the map
+    legend_data = {year: {} for year in layer_classes}
+    for year, classes in layer_classes.items():
+        for column, (edges, _) in classes.items():
+            label = layer_label(column)
+            legend_data[year][label] = legend_entry(legend_titles.get(label, label), edges, map_palettes[year])
+    class_counts = {palette: set() for palette in map_palettes.values()}
+    for year, classes in layer_classes.items():
+        class_counts[map_palettes[year]].update(len(edges) - 1 for edges, _ in classes.values())
+    legend_symbols_html = legend_symbols({palette: [color_brewer(palette, n=k) for k in sorted(counts)]
+                                          for palette, counts in class_counts.items()}, opacity=0.5)
+
+    # The redline layer is categorical, each polygon carries its HOLC colour
+    redline_palette, redline_codes = np.unique(
+        redline['fill'].fillna('#ff0000'),
+        return_inverse=True)
+
+    # The city outline is a single union of its source, done once and cached with the other geometry
+    boundary_levels = simplified_levels(
+        'boundary', boundary_digest,
+        lambda: [city_boundary(read_geodata(boundary_path, boundary_digest).geometry)], coverage=False)
+    boundary = gpd.GeoDataFrame(geometry=boundary_levels[max(boundary_levels)], crs='EPSG:4326')
+
+    # Write each geometry once for the whole page when the maps share it
+    shared_geometry = args.geometry == 'shared'
+    if shared_geometry:
+        def build_shared_data():
+            # Simplified once per source file at every level of detail, ZCTAs and precincts keep shared borders
+            shared_levels = {
+                'boundary': boundary_levels,
+                'zipcodes': simplified_levels(
+                    'zipcodes', inputs.zipcodes_digest, lambda: zipcodes.geometry),
+                'precincts': simplified_levels(
+                    'precincts', inputs.precincts_digest, lambda: precincts.geometry),
+                'redline': simplified_levels(
+                    'redline', inputs.redline_digest, lambda: redline.geometry, coverage=False),
+            }
+
+            # [levels, topology] of every layer, as written into the page or a layer file
+            if args.format == 'topojson':
+                return {name: [topology_levels(levels), topology(levels)] for name, levels in shared_levels.items()}
+            return {name: [geometry_levels(levels), None] for name, levels in shared_levels.items()}
+
+        shared_geometry_key = content_key(inputs.source_digest, args.format, boundary_digest,
+                                          inputs.zipcodes_digest, inputs.precincts_digest, inputs.redline_digest,
+                                          LEVELS, PRECISION)
+        shared_data = store.cached('shared-geometry', shared_geometry_key, build_shared_data)
+
+        # Only the boundary is on screen when the page opens, the overlays can wait until they are picked
+        overlays = [name for name in shared_data if name != 'boundary']
+        lazy = overlays if args.layers == 'lazy' else []
+        tiled = overlays if args.layers == 'tiles' else []
+        sources = {name: write_layer(name, shared_geometry_file(*shared_data[name])) for name in lazy}
+        tiles = None
+        if tiled:
+            tiles = {'url': write_tiles(inputs, workers), 'layers': tiled,
+                     'minZoom': min(TILE_ZOOMS), 'maxZoom': max(TILE_ZOOMS)}
+        inline = {name: data for name, data in shared_data.items() if name not in lazy + tiled}
+        shared_geometry_html = shared_geometry_script(
+            {name: levels for name, (levels, _) in inline.items()},
+            {name: layer_topology for name, (_, layer_topology) in inline.items() if layer_topology},
+            sources, tiles)
+    else:
+        shared_geometry_html = ''
+
+    # Each year's map is only rendered again when its data, classes or the code building it change
+    # The maps share the page's width
+    map_width = f'{100 / len(year_columns):g}vw'
+    map_keys = {year: content_key(inputs.source_digest, args.geometry, args.renderer, args.frame_times,
+                                  map_width, year, columns, layer_classes[year], map_palettes[year],
+                                  layer_values[year], boundary_digest, inputs.zipcodes_digest,
+                                  inputs.precincts_digest, inputs.redline_digest)
+                for year, columns in year_columns.items()}
+    stale = {}
+    for year, key in map_keys.items():
+        if not store.is_cached(f'map-{year}', key):
+            layers = map_layers(year_columns[year], layer_values[year], zipcodes, precincts, layer_classes[year],
+                                boundary, redline, redline_codes, redline_palette, shared_geometry,
+                                map_palettes[year])
+            stale[year] = (year_columns[year], layers)
+    rendered = render_maps(stale, workers, args.renderer, args.frame_times, map_width)
+    map_parts = {year: store.cached(f'map-{year}', key, lambda: rendered[year]) for year, key in map_keys.items()}
+    map_html = {year: html for year, (_, html) in map_parts.items()}
+
+    # Render the combined HTML in chunks, loading Leaflet and the other libraries once for every map
+    template = Template(combined_html_template)
+    return template.generate(library_includes_html=library_includes(map_parts.values()),
+                             shared_geometry_html=shared_geometry_html,
+                             legend_symbols_html=legend_symbols_html,
+                             legend_script=legend_script(legend_data),
+                             map_width=map_width, maps=map_html)
+
+
+def main():
+    args = parser.parse_args()
+    if args.geometry == 'inline' and args.format != 'geojson':
+        parser.error("--geometry inline embeds GeoJSON, use it with --format geojson")
+    if args.layers != 'inline' and args.geometry != 'shared':
+        parser.error(f"--layers {args.layers} loads the shared geometry, use it with --geometry shared")
+    unknown = [name for name in args.compress if name not in COMPRESSIONS]
+    if unknown:
+        parser.error(f"unknown compression {', '.join(unknown)}, expected some of {', '.join(COMPRESSIONS)}")
+    if 'br' in args.compress and brotli is None:
+        parser.error("--compress br needs the brotli package, pip install brotli")
+    if args.no_cache:
+        cache.CACHE_DIR = None
+    workers = args.workers or os.cpu_count()
+
+    # The layer files always get a .gz copy
+    layer_compressions = [name for name in COMPRESSIONS if name == 'gz' or name in args.compress]
+    try:
+        chunks = build_page(args, load_inputs(), workers,
+                            write_layer=functools.partial(write_layer_file, compressions=layer_compressions))
+    except ValueError as error:
+        parser.error(str(error))
+
+    # Each chunk of the page goes straight to the file and its compressed copies
+    with CompressedWriter(output_path, args.compress) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+    # Artifacts of sources and code that have since changed are never loaded again
+    freed = cache.prune(args.cache_days)
+    if freed:
+        print(f"Removed {freed:,} bytes of artifacts unused for {args.cache_days} days from cache/")
+
+    if args.layers != 'inline':
+        print(f"{output_path} fetches its layers from {data_dir if args.layers == 'lazy' else tiles_path}, "
+              f"open it from a web server, e.g. python -m http.server")
+
+    # Automatically open the combined HTML file in the default web browser
+    webbrowser.open('file://' + os.path.join(os.getcwd(), output_path))
+
+
+if __name__ == '__main__':
+    # Lets the map layers be rendered in worker processes, also from the PyInstaller build
+    multiprocessing.freeze_support()
+    main()
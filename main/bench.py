@@ -0,0 +1,325 @@
+import argparse
+import gc
+import gzip
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Where every run is appended, one JSON line per run, to compare against earlier commits
+HISTORY_PATH = 'bench-history.jsonl'
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process since the last reset_peak_rss, in MB """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Without /proc the peak can't be reset and covers the whole run
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def encoded_sizes(text):
+    """ {'bytes', 'gzip_bytes'} of text as written to the page """
+    data = text.encode()
+    return {'bytes': len(data), 'gzip_bytes': len(gzip.compress(data, compresslevel=9, mtime=0))}
+
+
+def scaled_frame(frame, factor, offsets, ids=None, step=0):
+    """ `factor` copies of `frame`, the i-th moved by offsets[i] and its `ids` column increased by i * `step` """
+    import pandas as pd
+
+    copies = []
+    for i in range(factor):
+        copy = frame.copy()
+        copy.geometry = copy.geometry.translate(*offsets[i])
+        if ids and i:
+            copy[ids] = (pd.to_numeric(copy[ids]) + i * step).astype(frame[ids].dtype)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def scaled_table(table, factor, ids, step):
+    """ `factor` copies of a CSV's rows, the i-th with its `ids` column increased by i * `step`, blank ids kept """
+    import pandas as pd
+
+    numbers = pd.to_numeric(table[ids], errors='coerce').astype('Int64')
+    copies = [table.assign(**{ids: numbers + i * step}) for i in range(factor)]
+    return pd.concat(copies, ignore_index=True)
+
+
+def write_data_tree(folder, factor):
+    """ Copy of the data base.py reads, with every area repeated `factor` times.
+
+    The copies of the city are laid out side by side on a grid, ZCTAs, precincts
+    and HOLC areas moved together, so each copy overlaps like the original and
+    nothing overlaps across copies. Every copy's ZIP codes and precincts get ids
+    of their own and their rows in the CSVs are repeated under those ids.
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    from base import census_pattern, precincts_path, redline_path, stop_frisk_pattern, zipcodes_path
+
+    zipcodes = gpd.read_file(zipcodes_path)
+    minx, miny, maxx, maxy = zipcodes.total_bounds
+    columns = math.ceil(math.sqrt(factor))
+    offsets = [((i % columns) * (maxx - minx) * 1.1, (i // columns) * (maxy - miny) * 1.1) for i in range(factor)]
+
+    # ZIP codes have five digits and precincts three, the copies count on from there
+    layers = [(zipcodes_path, zipcodes, 'modzcta', 100000), (precincts_path, None, 'precinct', 1000),
+              (redline_path, None, None, 0)]
+    for path, frame, ids, step in layers:
+        frame = gpd.read_file(path) if frame is None else frame
+        # Columns holding lists can't be written back, base.py doesn't read them
+        frame = frame[[column for column in frame.columns
+                       if not frame[column].map(lambda value: isinstance(value, (list, dict))).any()]]
+        target = os.path.join(folder, os.path.relpath(path, os.getcwd()))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        scaled_frame(frame, factor, offsets, ids, step).to_file(target)
+
+    for subfolder, pattern, ids, step in (('.', census_pattern, 'ZCTA', 100000),
+                                          ('stopandfrisk', stop_frisk_pattern, 'Precinct', 1000)):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+        for name in sorted(os.listdir(subfolder)):
+            if pattern.match(name):
+                table = pd.read_csv(os.path.join(subfolder, name), encoding='utf-8-sig')
+                scaled_table(table, factor, ids, step).to_csv(os.path.join(folder, subfolder, name), index=False)
+
+
+def run_stages(repeat, geometry, workers):
+    """ Time, peak memory and output size of every stage of a build from the data in the working directory.
+
+    Each stage of base.py runs `repeat` times on its own, with the cache off,
+    and keeps its fastest and median time and the highest peak RSS over its
+    runs. Later stages take the result of the earlier ones. The layers are
+    those of the latest year's map, their sizes what each adds to the page.
+    """
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+
+    import base
+    import cache
+    from classify import classify
+    from crosswalk import build_crosswalk
+    from geometry import build_levels, city_boundary, topology
+    from layers import shared_geometry_file, topology_levels
+    from maps import assemble_map, is_precinct_column, layer_label, map_layers, map_shell, render_layer
+    from panel import panel_values
+    from redlining import redlining_measures
+
+    cache.CACHE_DIR = None
+    stages = {}
+    layers = {}
+
+    def measure(stage, run, setup=None, results=stages):
+        times = []
+        peak = 0
+        for _ in range(repeat):
+            prepared = setup() if setup else None
+            gc.collect()
+            reset_peak_rss()
+            start = time.perf_counter()
+            result = run(prepared) if setup else run()
+            times.append(time.perf_counter() - start)
+            peak = max(peak, peak_rss_mb())
+        results[stage] = {'seconds': min(times), 'median_seconds': float(np.median(times)), 'peak_rss_mb': peak}
+        return result
+
+    census_paths = base.discover_years('.', base.census_pattern)
+    stop_frisk_paths = base.discover_years('stopandfrisk', base.stop_frisk_pattern)
+
+    zipcodes, precincts, redline = measure('read shapefiles', lambda: [
+        gpd.read_file(path) for path in (base.zipcodes_path, base.precincts_path, base.redline_path)])
+    zipcodes['modzcta'] = zipcodes['modzcta'].astype(str)
+    precincts['precinct'] = pd.to_numeric(precincts['precinct'], errors='coerce').astype('Int64')
+    _, stop_frisk = measure('read csv', lambda: (
+        [base.read_census_csv(path) for path in census_paths.values()],
+        [pd.read_csv(path) for path in stop_frisk_paths.values()]))
+    measure('clean_precinct', lambda: [base.clean_precinct(table.copy()) for table in stop_frisk])
+    boundary = measure('dissolve', lambda: city_boundary(zipcodes.geometry))
+    crosswalk = measure('crosswalk', lambda: build_crosswalk(zipcodes.geometry, precincts.geometry,
+                                                            zipcodes['pop_est']))
+    redlining = measure('redlining', lambda: {
+        geography: redlining_measures(frame.geometry, redline.geometry, redline['grade'])
+        for geography, frame in (('zipcodes', zipcodes), ('precincts', precincts))})
+    panel = measure('panel', lambda: base.load_panel(census_paths, stop_frisk_paths, zipcodes['modzcta'],
+                                                     precincts['precinct'], crosswalk, redlining))
+
+    def geometry_levels():
+        levels = {name: build_levels(np.asarray(frame.geometry, dtype=object), coverage=name != 'redline')
+                  for name, frame in (('zipcodes', zipcodes), ('precincts', precincts), ('redline', redline))}
+        return {name: (topology_levels(layer_levels), topology(layer_levels)) for name, layer_levels in levels.items()}
+
+    shared_data = measure('geometry levels', geometry_levels)
+
+    # The latest year's map is built layer by layer
+    args = base.parser.parse_args(['--geometry', geometry, '--format', 'topojson' if geometry == 'shared' else 'geojson'])
+    year = max(census_paths)
+    facilities_year = max(stop_frisk_paths) if stop_frisk_paths else None
+    columns = base.columns_for_year(year, stop_frisk_paths)
+    values = {column: panel_values(panel, *base.layer_source(year, column, facilities_year)) for column in columns}
+
+    def classify_layers():
+        classes = {}
+        for is_precinct in (False, True):
+            shown = [column for column in columns if is_precinct_column(column) == is_precinct]
+            edges, codes = classify(np.column_stack([values[column] for column in shown]), args.scheme, args.classes)
+            classes.update((column, (edges[i], codes[:, i])) for i, column in enumerate(shown))
+        return classes
+
+    classes = measure('classify', classify_layers)
+
+    redline_palette, redline_codes = np.unique(redline['fill'].fillna('#ff0000'), return_inverse=True)
+    tasks = map_layers(columns, values, zipcodes, precincts, classes,
+                       gpd.GeoDataFrame(geometry=[boundary], crs='EPSG:4326'), redline, redline_codes,
+                       redline_palette, geometry == 'shared')
+    map_id = map_shell(year, args.renderer)._id
+    rendered = []
+    for name, build, layer_args in tasks:
+        label = name if name in ('boundary', 'redline') else layer_label(name)
+        layer = measure(label, lambda: render_layer(map_id, (year, name), build, layer_args), results=layers)
+        layers[label].update(encoded_sizes(''.join(text for parts in layer.parts.values() for _, text in parts)))
+        rendered.append(layer)
+    stages['choropleths'] = {'seconds': sum(layer['seconds'] for layer in layers.values()),
+                             'median_seconds': sum(layer['median_seconds'] for layer in layers.values()),
+                             'peak_rss_mb': max(layer['peak_rss_mb'] for layer in layers.values())}
+
+    # assemble_map renders the map's figure, what get_root().render() did
+    measure('render', lambda shell: assemble_map(year, shell, rendered, columns),
+            setup=lambda: map_shell(year, args.renderer))
+
+    # Shared layers draw the geometry written once for the page, or once per layer file
+    if geometry == 'shared':
+        for name, (levels, layer_topology) in shared_data.items():
+            layers[f'{name} geometry'] = encoded_sizes(shared_geometry_file(levels, layer_topology))
+
+    # The whole page, every year and the change map, then its template on its own
+    inputs = measure('load_inputs', base.load_inputs)
+    measure('build_page', lambda: base.build_page(args, inputs, workers))
+    html = measure('template', lambda chunks: ''.join(chunks), setup=lambda: base.build_page(args, inputs, workers))
+
+    return {'stages': stages, 'layers': layers, 'page': encoded_sizes(html),
+            'features': {'zipcodes': len(zipcodes), 'precincts': len(precincts), 'redline': len(redline)},
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run_scale(scale, args):
+    """ Results of run_stages on the data scaled `scale` times, in a process of its own so memory peaks are its own """
+    folder = os.getcwd() if scale == 1 else tempfile.mkdtemp(prefix=f'bench-{scale}x-')
+    try:
+        if scale != 1:
+            write_data_tree(folder, scale)
+        with tempfile.NamedTemporaryFile(suffix='.json') as result:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--repeat', str(args.repeat),
+                            '--geometry', args.geometry, '--workers', str(args.workers), '--run', result.name],
+                           cwd=folder, check=True, stdout=subprocess.DEVNULL)
+            with open(result.name) as f:
+                return json.load(f)
+    finally:
+        if scale != 1:
+            shutil.rmtree(folder)
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(runs, previous=None):
+    """ Tables of the time and peak memory of every stage and the size of every layer, at every scale """
+    scales = list(runs)
+    print(f"{'stage':<20}" + ''.join(f"{f'{scale}x':>22}" for scale in scales))
+    for stage in runs[scales[0]]['stages']:
+        cells = []
+        for scale in scales:
+            result = runs[scale]['stages'][stage]
+            cells.append(f"{result['seconds']:9.3f} s {result['peak_rss_mb']:7.0f} MB")
+        print(f'{stage:<20}' + ''.join(f'{cell:>22}' for cell in cells))
+
+    for scale in scales:
+        print(f"\n{f'layers of the {scale}x map':<30}{'seconds':>10}{'bytes':>14}{'gzipped':>14}")
+        for label, layer in runs[scale]['layers'].items():
+            seconds = f"{layer['seconds']:.3f}" if 'seconds' in layer else ''
+            print(f"{label:<30}{seconds:>10}{layer['bytes']:>14,}{layer['gzip_bytes']:>14,}")
+    for scale in scales:
+        run = runs[scale]
+        features = ', '.join(f'{count} {name}' for name, count in run['features'].items())
+        print(f"{scale}x ({features}): page {run['page']['bytes']:,} bytes, {run['page']['gzip_bytes']:,} gzipped, "
+              f"peak RSS {run['peak_rss_mb']:.0f} MB")
+
+    # Stages that moved by more than a tenth since the last run recorded
+    if previous:
+        print(f"\nCompared with {previous['commit']} ({previous['date']}):")
+        for scale in scales:
+            before = previous['scales'].get(scale, {}).get('stages', {})
+            for stage, result in runs[scale]['stages'].items():
+                if stage in before and before[stage]['seconds'] > 0:
+                    ratio = result['seconds'] / before[stage]['seconds']
+                    if abs(ratio - 1) > 0.1:
+                        print(f"  {scale}x {stage}: {before[stage]['seconds']:.3f} s -> {result['seconds']:.3f} s "
+                              f"({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every stage of the build, and the memory and page size it '
+                                                 'takes, on the repo data and on copies of it scaled up')
+    parser.add_argument('--scales', type=lambda text: [int(scale) for scale in text.split(',')], default=[1, 10],
+                        help='comma-separated times the data is repeated, 1 for the repo data as is (default 1,10)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every stage, the fastest is kept (default 3)')
+    parser.add_argument('--geometry', choices=['shared', 'inline'], default='shared',
+                        help="how the layers carry their geometry, as base.py's --geometry")
+    parser.add_argument('--workers', type=int, default=1, help='processes build_page renders the layers on')
+    parser.add_argument('--history', default=HISTORY_PATH,
+                        help=f"file every run is appended to and compared with, 'none' to keep no record "
+                             f"(default {HISTORY_PATH})")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Run by run_scale in the folder of the data
+    if args.run:
+        with open(args.run, 'w') as f:
+            json.dump(run_stages(args.repeat, args.geometry, args.workers), f)
+        return
+
+    runs = {str(scale): run_scale(scale, args) for scale in args.scales}
+
+    previous = None
+    if args.history != 'none' and os.path.exists(args.history):
+        with open(args.history) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        previous = next((record for record in reversed(records) if record['geometry'] == args.geometry), None)
+    report(runs, previous)
+
+    if args.history != 'none':
+        record = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit(), 'python': platform.python_version(),
+                  'machine': platform.platform(), 'cpus': os.cpu_count(), 'repeat': args.repeat,
+                  'geometry': args.geometry, 'workers': args.workers, 'scales': runs}
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Where build artifacts are kept between runs, None turns the cache off
+CACHE_DIR = 'cache'
+
+# Bump when the layout of cached artifacts changes so old entries are ignored
+CACHE_VERSION = 1
+
+# Entries no build has loaded for this many days are removed by `prune`
+MAX_AGE_DAYS = 30
+
+# Files that belong to a shapefile and change what gpd.read_file returns
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+# Digests of files already hashed, reused while a file's size and mtime stay the same
+_digests = None
+
+
+def _digest_index():
+    return os.path.join(CACHE_DIR, 'digests.json')
+
+
+def file_digest(path):
+    """ sha256 of a file's contents.
+
+    Hashing every source costs more than parsing it, so the digest is
+    remembered against the file's size and mtime and only recomputed when
+    either changes. Keys stay content-based: touching a file rehashes it but
+    invalidates nothing.
+    """
+    global _digests
+    if _digests is None:
+        _digests = {}
+        if CACHE_DIR is not None and os.path.exists(_digest_index()):
+            with open(_digest_index()) as f:
+                _digests = json.load(f)
+
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    known = _digests.get(path)
+    if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _digests[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    if CACHE_DIR is not None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _write_atomic(_digest_index(), lambda f: f.write(json.dumps(_digests, indent=0).encode()))
+    return digest.hexdigest()
+
+
+def shapefile_digest(path):
+    """ Digest of a .shp file together with its sidecar files """
+    stem, _ = os.path.splitext(path)
+    return [file_digest(stem + part) for part in SHAPEFILE_PARTS if os.path.exists(stem + part)]
+
+
+def code_digest(paths):
+    """ Digest of the source files an artifact is built by, skipping any that are not on disk (PyInstaller) """
+    return [file_digest(path) for path in paths if os.path.exists(path)]
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return [str(value.dtype), value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()]
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Cannot build a cache key from {type(value).__name__}')
+
+
+def content_key(*parts):
+    """ Short stable hash of everything an artifact depends on """
+    payload = json.dumps([CACHE_VERSION, *parts], default=_json_default, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def is_cached(name, key):
+    """ Whether `cached` has the artifact `name` for `key` on disk """
+    return CACHE_DIR is not None and os.path.exists(os.path.join(CACHE_DIR, f'{name}-{key}.pkl'))
+
+
+def cached(name, key, build):
+    """ Load the artifact `name` built from inputs hashing to `key`, or build and store it """
+    if CACHE_DIR is None:
+        return build()
+
+    path = os.path.join(CACHE_DIR, f'{name}-{key}.pkl')
+    if os.path.exists(path):
+        _touch(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    value = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(path, lambda f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL))
+    return value
+
+
+def cached_frame(name, key, build):
+    """ Like `cached` for a GeoDataFrame, stored as an Arrow (Feather) file with WKB geometry.
+
+    The file is uncompressed so it is read memory-mapped, columns are only
+    copied when they are used. Without pyarrow the frame is pickled instead.
+    """
+    if CACHE_DIR is None or feather is None:
+        return cached(name, key, build)
+
+    import geopandas as gpd
+
+    path = os.path.join(CACHE_DIR, f'{name}-{key}.arrow')
+    if os.path.exists(path):
+        _touch(path)
+        return gpd.GeoDataFrame.from_arrow(feather.read_table(path, memory_map=True))
+
+    frame = build()
+    table = pa.table(frame.to_arrow(geometry_encoding='WKB'))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(path, lambda f: feather.write_feather(table, f, compression='uncompressed'))
+    return frame
+
+
+def prune(max_age_days=MAX_AGE_DAYS):
+    """ Remove the entries no build has loaded for `max_age_days`, and temporary files left by interrupted builds.
+
+    Every load marks an entry as used, so what goes is what the sources and
+    code no longer build. Returns the bytes freed.
+    """
+    if CACHE_DIR is None or not os.path.isdir(CACHE_DIR):
+        return 0
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    freed = 0
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name == 'digests.json' or not entry.is_file():
+            continue
+        stat = entry.stat()
+        if stat.st_mtime < cutoff:
+            os.remove(entry.path)
+            freed += stat.st_size
+    return freed
+
+
+def _touch(path):
+    # The modification time records the last use for `prune`, a read-only cache is still read
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _write_atomic(path, write):
+    # Write next to the final name and swap it in, so an interrupted build never leaves half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        write(f)
+    os.replace(temporary, path)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# Kinds of change between two years, with the suffix of their layer's name
+CHANGES = {
+    'absolute': 'Change',
+    'percent': '% Change',
+    'rank': 'Rank Change',
+}
+
+# Colour scheme of the change layers, no change sits in the middle
+CHANGE_PALETTE = 'PuOr'
+
+
+def change_column(indicator, kind):
+    """ Name of the layer showing one kind of change of `indicator` """
+    return f'{indicator} {CHANGES[kind]}'
+
+
+def compute_changes(before, after, kinds=tuple(CHANGES)):
+    """ Change of every column of two aligned (features x indicators) arrays, as {kind: array}.
+
+    'absolute' is after - before, 'percent' the same relative to |before| and
+    NaN where before is 0. 'rank' is how many places a feature moved up when
+    each year is ranked from the highest value, counting only features with a
+    value in both years.
+    """
+    before = np.asarray(before, dtype=float)
+    after = np.asarray(after, dtype=float)
+    difference = after - before
+
+    changes = {}
+    if 'absolute' in kinds:
+        changes['absolute'] = difference
+    if 'percent' in kinds:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = difference / np.abs(before) * 100
+        changes['percent'] = np.where(np.isfinite(percent), percent, np.nan)
+    if 'rank' in kinds:
+        missing = np.isnan(difference)
+        ranks = [pd.DataFrame(np.where(missing, np.nan, values)).rank(ascending=False).to_numpy()
+                 for values in (before, after)]
+        changes['rank'] = ranks[0] - ranks[1]
+    return changes
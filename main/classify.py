@@ -0,0 +1,186 @@
+import warnings
+
+import numpy as np
+
+SCHEMES = ('equal_interval', 'quantile', 'natural_breaks')
+
+# Scheme for values that change sign, like the change between two years
+DIVERGING = 'diverging'
+
+# Scheme binning on given edges, for the columns in base.fixed_breaks
+FIXED = 'fixed'
+
+# Code written for features with no data
+MISSING = 255
+
+# Characters used to write class codes into the page, one per feature
+CODE_CHARS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# ColorBrewer palettes start at 3 colours, and every class needs a character of its own
+MIN_CLASSES = 3
+MAX_CLASSES = len(CODE_CHARS)
+
+
+def equal_interval_breaks(values, k):
+    """ Equal-width edges for every column, matching np.histogram's bin edges """
+    empty = np.isnan(values).all(axis=0)
+    filled = np.where(empty, 0.0, values)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low = np.nanmin(filled, axis=0)
+        high = np.nanmax(filled, axis=0)
+    low = np.where(empty, 0.0, low)
+    high = np.where(empty, 1.0, high)
+
+    # np.histogram widens a zero-width range by half a unit on either side
+    flat = low == high
+    low = np.where(flat, low - 0.5, low)
+    high = np.where(flat, high + 0.5, high)
+    return np.linspace(low, high, k + 1, axis=1)
+
+
+def diverging_breaks(values, k):
+    """ Equal-width edges for every column, symmetric around zero so the middle edge (or class) is no change """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        extent = np.nanmax(np.abs(values), axis=0)
+    extent = np.where(np.isnan(extent) | (extent == 0), 0.5, extent)
+    # Steps of 2/k from -1 to 1 keep the middle edge at exactly zero
+    return extent[:, None] * (np.arange(-k, k + 1, 2) / k)
+
+
+def quantile_breaks(values, k):
+    """ Edges at the 0, 1/k, ..., 1 quantiles of every column """
+    empty = np.isnan(values).all(axis=0)
+    filled = np.where(empty, 0.0, values)
+    edges = np.nanquantile(filled, np.linspace(0, 1, k + 1), axis=0).T
+    edges[empty] = np.linspace(0, 1, k + 1)
+    return edges
+
+
+def natural_breaks(values, k):
+    """ Fisher-Jenks optimal breaks for one column.
+
+    The dynamic programme runs over the distinct values weighted by their counts,
+    with prefix sums for the within-class cost and divide and conquer on the
+    (monotone) optimal split, so each class level costs O(n log n) not O(n^2).
+    The returned edges are the lower bound of every class plus the maximum.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.linspace(0, 1, k + 1)
+
+    unique, counts = np.unique(values, return_counts=True)
+    n = len(unique)
+    if n <= k:
+        # Every distinct value gets its own class, repeat the maximum for the rest
+        return np.concatenate([unique, np.repeat(unique[-1], k + 1 - n)])
+
+    weight = np.concatenate([[0.0], np.cumsum(counts, dtype=float)])
+    total = np.concatenate([[0.0], np.cumsum(counts * unique)])
+    square = np.concatenate([[0.0], np.cumsum(counts * unique * unique)])
+
+    def cost(start, end):
+        # Sum of squared deviations of the class unique[start..end]
+        w = weight[end + 1] - weight[start]
+        s = total[end + 1] - total[start]
+        return (square[end + 1] - square[start]) - s * s / w
+
+    previous = cost(np.zeros(n, dtype=int), np.arange(n))
+    starts = np.zeros((k, n), dtype=int)
+
+    for level in range(1, k):
+        current = np.full(n, np.inf)
+        # Every open sub-problem: (first end, last end, first start, last start).
+        # All sub-problems at one recursion depth are solved together.
+        end_lo = np.array([level])
+        end_hi = np.array([n - 1])
+        start_lo = np.array([level])
+        start_hi = np.array([n - 1])
+        while len(end_lo):
+            end = (end_lo + end_hi) // 2
+            sizes = np.minimum(start_hi, end) - start_lo + 1
+            offsets = np.cumsum(sizes) - sizes
+            node = np.repeat(np.arange(len(end)), sizes)
+            candidates = start_lo[node] + np.arange(sizes.sum()) - offsets[node]
+            costs = previous[candidates - 1] + cost(candidates, end[node])
+
+            # First candidate reaching the minimum of its sub-problem
+            lowest = np.minimum.reduceat(costs, offsets)
+            hits = np.flatnonzero(costs == lowest[node])
+            _, first = np.unique(node[hits], return_index=True)
+            best = candidates[hits[first]]
+            current[end] = lowest
+            starts[level, end] = best
+
+            end_lo, end_hi, start_lo, start_hi = (
+                np.concatenate(pair) for pair in (
+                    (end_lo, end + 1), (end - 1, end_hi), (start_lo, best), (best, start_hi)))
+            keep = end_lo <= end_hi
+            end_lo, end_hi, start_lo, start_hi = end_lo[keep], end_hi[keep], start_lo[keep], start_hi[keep]
+        previous = current
+
+    # Walk back from the last class to recover where each class starts
+    edges = [unique[-1]]
+    end = n - 1
+    for level in range(k - 1, 0, -1):
+        start = starts[level, end]
+        edges.append(unique[start])
+        end = start - 1
+    edges.append(unique[0])
+    return np.array(edges[::-1])
+
+
+def assign_classes(values, edges):
+    """ Class index of every value, left-closed bins with the last bin closed """
+    interior = edges[:, 1:-1]
+    codes = (values[:, :, None] >= interior[None, :, :]).sum(axis=2).astype(np.uint8)
+    codes[np.isnan(values)] = MISSING
+    return codes
+
+
+def classify(values, scheme='equal_interval', k=6, breaks=None):
+    """ Bin every column of a (features x layers) array in one pass.
+
+    Returns the (layers x k + 1) class edges and a (features x layers) uint8
+    array of class codes, MISSING where a feature has no value.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+
+    if scheme == 'equal_interval':
+        edges = equal_interval_breaks(values, k)
+    elif scheme == 'quantile':
+        edges = quantile_breaks(values, k)
+    elif scheme == 'natural_breaks':
+        edges = np.vstack([natural_breaks(column, k) for column in values.T])
+    elif scheme == DIVERGING:
+        edges = diverging_breaks(values, k)
+    elif scheme == FIXED:
+        if breaks is None:
+            raise ValueError(f"The '{FIXED}' scheme needs a list of breaks")
+        edges = np.tile(np.asarray(breaks, dtype=float), (values.shape[1], 1))
+    else:
+        raise ValueError(f"Unknown classification scheme '{scheme}', expected one of {SCHEMES + (DIVERGING, FIXED)}")
+
+    return edges, assign_classes(values, edges)
+
+
+def class_count(text):
+    """ Number of classes written in `text`, ValueError unless it is from MIN_CLASSES to MAX_CLASSES """
+    try:
+        k = int(text)
+    except ValueError:
+        raise ValueError(f"the number of classes must be a whole number, not {text!r}") from None
+    if not MIN_CLASSES <= k <= MAX_CLASSES:
+        raise ValueError(f"the number of classes must be from {MIN_CLASSES} to {MAX_CLASSES}, not {k}")
+    return k
+
+
+def encode_codes(codes):
+    """ Write a column of class codes as one character per feature, '-' for missing """
+    lookup = np.full(256, '-')
+    lookup[:len(CODE_CHARS)] = list(CODE_CHARS)
+    return ''.join(lookup[np.asarray(codes, dtype=np.uint8)])
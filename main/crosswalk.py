@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# Equal-area enough for NYC: New York State Plane, Long Island, in feet
+AREA_CRS = 'EPSG:2263'
+
+
+def intersection_areas(source, target):
+    """ (source position, target position, area) of every pair of polygons that overlap.
+
+    Candidate pairs come from an STRtree over `target`, so only polygons whose
+    bounding boxes meet are tested, and only pairs that touch are intersected.
+    Both are arrays of projected geometries.
+    """
+    source = np.asarray(source, dtype=object)
+    target = np.asarray(target, dtype=object)
+    source_index, target_index = shapely.STRtree(target).query(source, predicate='intersects')
+    areas = shapely.area(shapely.intersection(source[source_index], target[target_index]))
+    overlap = areas > 0
+    return source_index[overlap], target_index[overlap], areas[overlap]
+
+
+def build_crosswalk(zipcodes, precincts, population=None):
+    """ Table of every ZCTA and precinct piece: positions, area and an estimated population.
+
+    `zipcodes` and `precincts` are GeoSeries; a piece's population is its
+    ZCTA's `population` spread by area, so it is NaN without one.
+    """
+    zipcode_index, precinct_index, areas = intersection_areas(
+        zipcodes.to_crs(AREA_CRS).to_numpy(), precincts.to_crs(AREA_CRS).to_numpy())
+    crosswalk = pd.DataFrame({'zipcode': zipcode_index, 'precinct': precinct_index, 'area': areas})
+    if population is None:
+        crosswalk['population'] = np.nan
+    else:
+        zipcode_areas = crosswalk.groupby('zipcode')['area'].transform('sum')
+        population = np.asarray(population, dtype=float)[zipcode_index]
+        crosswalk['population'] = population * crosswalk['area'] / zipcode_areas
+    return crosswalk
+
+
+def crosswalk_matrix(crosswalk, source, target, sizes, weight='area', intensive=False):
+    """ (target x source) matrix moving values from one geography onto the other.
+
+    `source` and `target` are 'zipcode' or 'precinct' and `sizes` the number
+    of features of each. For counts (extensive values) every source value is
+    split across its pieces in proportion to `weight`. For rates, medians and
+    other intensive values each target gets the `weight`-weighted mean of the
+    sources covering it.
+    """
+    weights = crosswalk[weight].to_numpy(dtype=float)
+    rows = crosswalk[target].to_numpy()
+    columns = crosswalk[source].to_numpy()
+    totals = np.bincount(rows if intensive else columns, weights, minlength=sizes[target if intensive else source])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = weights / (totals[rows] if intensive else totals[columns])
+    shares = np.nan_to_num(shares)
+
+    shape = (sizes[target], sizes[source])
+    if sparse is None:
+        matrix = np.zeros(shape)
+        np.add.at(matrix, (rows, columns), shares)
+        return matrix
+    return sparse.csr_matrix((shares, (rows, columns)), shape=shape)
+
+
+def reaggregate(matrix, values, intensive=False):
+    """ Apply a crosswalk_matrix to a (features x columns) array, or a single column.
+
+    Sources without a value are left out: counts add up what is there and
+    intensive values are averaged over the sources that have one. A target
+    none of whose sources has a value is NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    present = ~np.isnan(values)
+    moved = matrix @ np.where(present, values, 0.0)
+    covered = matrix @ present.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(covered > 0, moved / covered if intensive else moved, np.nan)
@@ -0,0 +1,188 @@
+import json
+import warnings
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from cache import cached, content_key
+
+# Simplification tolerance (in degrees) used from each minimum zoom level upwards
+LEVELS = {0: 0.0004, 12: 0.0001, 14: 0.00002}
+
+# Decimal places kept in every coordinate, 5 is about a metre
+PRECISION = 5
+
+# Bump when the preprocessing output changes so old cache entries are ignored
+GEOMETRY_VERSION = 2
+
+
+def quantize(geometries, precision=PRECISION):
+    """ Round every coordinate to a fixed number of decimals """
+    return shapely.transform(geometries, lambda coords: np.round(coords, precision))
+
+
+def simplify(geometries, tolerance, coverage=True):
+    """ Simplify a set of polygons.
+
+    For a coverage (polygons tiling an area, like ZCTAs) every shared border is
+    simplified once so neighbours stay gap-free. Other layers are simplified
+    one polygon at a time.
+    """
+    if coverage:
+        if hasattr(shapely, 'coverage_simplify'):
+            return shapely.coverage_simplify(geometries, tolerance)
+        warnings.warn('shapely.coverage_simplify needs shapely 2.1 and GEOS 3.12, '
+                      'shared borders may open up when simplified')
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def city_boundary(geometries):
+    """ Outline of everything in `geometries` as one (multi)polygon """
+    return shapely.union_all(np.asarray(geometries, dtype=object))
+
+
+def build_levels(geometries, coverage=True, levels=LEVELS, precision=PRECISION):
+    """ The simplified, quantized geometry for every level of detail, keyed by minimum zoom """
+    geometries = np.asarray(geometries, dtype=object)
+    return {zoom: quantize(simplify(geometries, tolerance, coverage), precision)
+            for zoom, tolerance in levels.items()}
+
+
+def geojson_bytes(geometries):
+    return len(json.dumps([mapping(geometry) for geometry in geometries], separators=(',', ':')))
+
+
+def report(name, original, levels):
+    """ Print vertex counts and GeoJSON sizes of each level against the source """
+    vertices = shapely.get_num_coordinates(original).sum()
+    size = geojson_bytes(original)
+    print(f"{name}: {vertices} vertices, {size / 1024:.0f} KB as GeoJSON")
+    for zoom, geometries in levels.items():
+        level_vertices = shapely.get_num_coordinates(geometries).sum()
+        level_size = geojson_bytes(geometries)
+        print(f"  zoom {zoom}+: {level_vertices} vertices ({level_vertices / vertices:.0%}), "
+              f"{level_size / 1024:.0f} KB ({1 - level_size / size:.0%} smaller)")
+
+
+def _junctions(keys, starts, lengths):
+    """ Mark the ring points where a shared border starts or ends.
+
+    A point is a junction when it is seen with more than one pair of
+    neighbours, e.g. where three ZCTAs meet or a shared border reaches the
+    city edge. Points along a border shared by two rings are not.
+    """
+    ring = np.repeat(np.arange(len(starts)), lengths)
+    position = np.arange(len(keys)) - starts[ring]
+    previous = keys[starts[ring] + (position - 1) % lengths[ring]]
+    following = keys[starts[ring] + (position + 1) % lengths[ring]]
+    pairs = np.stack([keys, np.minimum(previous, following), np.maximum(previous, following)], axis=1)
+    distinct = np.unique(pairs, axis=0)
+    points, counts = np.unique(distinct[:, 0], return_counts=True)
+    return np.isin(keys, points[counts > 1])
+
+
+def topology(levels, precision=PRECISION):
+    """ Encode every level of detail of one layer as a TopoJSON Topology.
+
+    Rings are cut into arcs at junctions and each border shared by two
+    polygons is stored once; coordinates are written as integer deltas on
+    the grid the geometry was quantized to. Objects are keyed by minimum zoom.
+    """
+    factor = 10 ** precision
+    ragged = {zoom: shapely.to_ragged_array(geometries) for zoom, geometries in levels.items()}
+    origin = np.min([coords.min(axis=0) for _, coords, _ in ragged.values()], axis=0)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(points, closed):
+        forward = tuple(points)
+        backward = forward[::-1]
+        if closed:
+            # Rings without junctions are compared from their lowest point
+            forward = _rotate(forward[:-1])
+            backward = _rotate(backward[:-1])
+        canonical = min(forward, backward)
+        if canonical not in arc_index:
+            arc_index[canonical] = len(arcs)
+            arcs.append(canonical)
+        return arc_index[canonical] if canonical == forward else ~arc_index[canonical]
+
+    objects = {}
+    for zoom, (geometry_type, coords, offsets) in ragged.items():
+        if geometry_type == shapely.GeometryType.POLYGON:
+            ring_offsets, geometry_offsets = offsets
+            polygon_offsets = np.arange(len(geometry_offsets))
+        else:
+            ring_offsets, geometry_offsets, polygon_offsets = offsets
+
+        grid = np.rint((coords - origin) * factor).astype(np.int64)
+        # Drop each ring's closing point, then key every point by its grid cell
+        lengths = np.diff(ring_offsets) - 1
+        keep = np.ones(len(grid), dtype=bool)
+        keep[ring_offsets[1:] - 1] = False
+        keys = (grid[keep, 0] << 32) | grid[keep, 1]
+        starts = np.cumsum(lengths) - lengths
+        junction = _junctions(keys, starts, lengths)
+
+        rings = []
+        for start, length in zip(starts.tolist(), lengths.tolist()):
+            ring_keys = keys[start:start + length].tolist()
+            cuts = np.flatnonzero(junction[start:start + length]).tolist()
+            if not cuts:
+                rings.append([add_arc(ring_keys + ring_keys[:1], closed=True)])
+                continue
+            ring_keys = ring_keys[cuts[0]:] + ring_keys[:cuts[0]]
+            cuts = [cut - cuts[0] for cut in cuts] + [length]
+            ring_keys.append(ring_keys[0])
+            rings.append([add_arc(ring_keys[a:b + 1], closed=False) for a, b in zip(cuts, cuts[1:])])
+
+        geometries = []
+        for position in range(len(polygon_offsets) - 1):
+            polygons = [rings[geometry_offsets[polygon]:geometry_offsets[polygon + 1]]
+                        for polygon in range(polygon_offsets[position], polygon_offsets[position + 1])]
+            if not polygons:
+                continue
+            if len(polygons) == 1:
+                geometries.append({'type': 'Polygon', 'id': position, 'arcs': polygons[0]})
+            else:
+                geometries.append({'type': 'MultiPolygon', 'id': position, 'arcs': polygons})
+        objects[str(zoom)] = {'type': 'GeometryCollection', 'geometries': geometries}
+
+    # Each arc is written as its first grid point followed by deltas
+    encoded = []
+    for arc in arcs:
+        points = np.array([(key >> 32, key & 0xFFFFFFFF) for key in arc], dtype=np.int64)
+        points[1:] = np.diff(points, axis=0)
+        encoded.append(points.tolist())
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [1 / factor, 1 / factor], 'translate': origin.tolist()},
+        'objects': objects,
+        'arcs': encoded,
+    }
+
+
+def _rotate(points):
+    """ A closed ring's points starting from its lowest one, closing point included """
+    start = points.index(min(points))
+    rotated = points[start:] + points[:start]
+    return rotated + rotated[:1]
+
+
+def simplified_levels(name, digest, load, coverage=True):
+    """ Levels of detail for one layer, cached on disk per source file.
+
+    `digest` identifies the source contents; `load` returns the source geometries
+    and is only called when the cache has no entry for them.
+    """
+    def build():
+        original = np.asarray(load(), dtype=object)
+        levels = build_levels(original, coverage)
+        report(name, original, levels)
+        return levels
+
+    key = content_key(GEOMETRY_VERSION, name, digest, LEVELS, PRECISION, coverage)
+    return cached(f'levels-{name}', key, build)
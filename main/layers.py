@@ -0,0 +1,361 @@
+import json
+
+from branca.element import Element, MacroElement
+from folium.map import Layer
+from jinja2 import Template
+from shapely.geometry import mapping
+
+from classify import encode_codes
+from tiles import TILE_SCRIPT
+
+# Name of the page-level object every shared layer reads its geometry from
+SHARED_GEOMETRY_VAR = 'nycGeometry'
+
+
+def geometry_collection(geometries):
+    """ Build a GeoJSON FeatureCollection holding only the geometry
+
+    Each feature's id is its row position, which is where overlays look up its class code.
+    """
+    features = []
+    for position, geometry in enumerate(geometries):
+        if geometry is None:
+            continue
+        features.append({
+            'type': 'Feature',
+            'id': position,
+            'properties': {},
+            'geometry': mapping(geometry),
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def geometry_levels(levels):
+    """ [[minimum zoom, FeatureCollection], ...] for every level of detail, coarsest first """
+    return [[zoom, geometry_collection(levels[zoom])] for zoom in sorted(levels)]
+
+
+def topology_levels(levels):
+    """ [[minimum zoom, topology object name], ...], decoded on the page when first shown """
+    return [[zoom, str(zoom)] for zoom in sorted(levels)]
+
+
+def shared_geometry_script(geometries, topologies=None, sources=None, tiles=None):
+    """ Write every shared geometry once for the whole page
+
+    With `topologies` the levels in `geometries` name objects of each layer's
+    TopoJSON topology instead of holding GeoJSON. Layers in `sources` are not
+    written into the page, they are fetched from the given URL the first time
+    they are shown; see `shared_geometry_file`. The overlays of the `layers`
+    listed in `tiles` are drawn from the vector tiles of the PMTiles archive
+    at its `url`, `minZoom` and `maxZoom` being the zooms it holds.
+    """
+    payload = json.dumps(geometries, separators=(',', ':'))
+    topology_payload = json.dumps(topologies or {}, separators=(',', ':'))
+    sources_payload = json.dumps(sources or {}, separators=(',', ':'))
+    tile_script = f"var nycTiles = {json.dumps(tiles, separators=(',', ':'))};\n{TILE_SCRIPT}" if tiles else ''
+    return f"""<script>
+    var {SHARED_GEOMETRY_VAR} = {payload};
+    var nycTopology = {topology_payload};
+    var nycSources = {sources_payload};
+    var nycPending = {{}};
+
+    // Fetch a layer kept out of the page once, every map showing it waits on the same request
+    function nycLoad(name) {{
+        if (!nycPending[name]) {{
+            nycPending[name] = fetch(nycSources[name])
+                .then(function(response) {{
+                    if (!response.ok) {{
+                        throw new Error(response.status + ' ' + response.statusText);
+                    }}
+                    return response.json();
+                }})
+                .then(function(data) {{
+                    {SHARED_GEOMETRY_VAR}[name] = data.levels;
+                    if (data.topology) {{
+                        nycTopology[name] = data.topology;
+                    }}
+                }})
+                .catch(function(error) {{
+                    delete nycPending[name];
+                    console.error('Could not load the ' + name + ' layer from ' + nycSources[name], error);
+                    throw error;
+                }});
+        }}
+        return nycPending[name];
+    }}
+
+    // Turn one object of a quantized, delta-encoded TopoJSON topology back into GeoJSON
+    function nycDecodeTopology(topology, key) {{
+        var scale = topology.transform.scale;
+        var translate = topology.transform.translate;
+        if (!topology.decodedArcs) {{
+            topology.decodedArcs = topology.arcs.map(function(arc) {{
+                var x = 0, y = 0;
+                return arc.map(function(point) {{
+                    x += point[0];
+                    y += point[1];
+                    return [x * scale[0] + translate[0], y * scale[1] + translate[1]];
+                }});
+            }});
+        }}
+        var arcs = topology.decodedArcs;
+        function ring(indexes) {{
+            var points = [];
+            indexes.forEach(function(index, n) {{
+                var arc = index < 0 ? arcs[~index].slice().reverse() : arcs[index];
+                points.push.apply(points, n ? arc.slice(1) : arc);
+            }});
+            return points;
+        }}
+        function polygon(rings) {{
+            return rings.map(ring);
+        }}
+        return {{
+            type: 'FeatureCollection',
+            features: topology.objects[key].geometries.map(function(geometry) {{
+                return {{
+                    type: 'Feature',
+                    id: geometry.id,
+                    properties: {{}},
+                    geometry: {{
+                        type: geometry.type,
+                        coordinates: geometry.type === 'Polygon' ? polygon(geometry.arcs) : geometry.arcs.map(polygon)
+                    }}
+                }};
+            }})
+        }};
+    }}
+
+    // GeoJSON of one level of detail, decoded from its topology the first time it is needed
+    function nycLevelData(name, level) {{
+        if (typeof level[1] === 'string') {{
+            level[1] = nycDecodeTopology(nycTopology[name], level[1]);
+        }}
+        return level[1];
+    }}
+
+    // Fill a shared layer with the level of detail for the map's zoom, only while it is shown
+    function nycLevelOfDetail(map, name, layer) {{
+        var current = null;
+        function refresh() {{
+            if (!map.hasLayer(layer)) {{
+                return;
+            }}
+            var levels = {SHARED_GEOMETRY_VAR}[name];
+            if (!levels) {{
+                nycLoad(name).then(refresh, function() {{}});
+                return;
+            }}
+            var zoom = map.getZoom();
+            var level = levels[0];
+            for (var i = 1; i < levels.length && levels[i][0] <= zoom; i++) {{
+                level = levels[i];
+            }}
+            var data = nycLevelData(name, level);
+            if (data !== current) {{
+                current = data;
+                layer.clearLayers();
+                layer.addData(data);
+            }}
+        }}
+        layer.on('add', refresh);
+        map.on('zoomend', refresh);
+        return layer;
+    }}
+
+    // Overlays drawn on the same geometry share one layer per map. Picking an
+    // overlay only restyles the paths already drawn, it doesn't rebuild them.
+    var nycOverlayClass = null;
+
+    function nycOverlay(map, name, style, options) {{
+        if (!nycOverlayClass) {{
+            nycOverlayClass = L.Layer.extend({{
+                initialize: function(shared, style) {{
+                    this.shared = shared;
+                    this.style = style;
+                }},
+                onAdd: function(map) {{
+                    var shared = this.shared;
+                    shared.nycOverlay = this;
+                    // Paths kept from an earlier overlay, shown or not, still have its colours
+                    shared.setStyle(this.style);
+                    if (!map.hasLayer(shared)) {{
+                        map.addLayer(shared);
+                    }}
+                }},
+                onRemove: function(map) {{
+                    var shared = this.shared;
+                    if (shared.nycOverlay !== this) {{
+                        return;
+                    }}
+                    shared.nycOverlay = null;
+                    // The layer control removes the old overlay before it adds the new one,
+                    // only take the paths down if nothing took over
+                    Promise.resolve().then(function() {{
+                        if (!shared.nycOverlay) {{
+                            map.removeLayer(shared);
+                        }}
+                    }});
+                }}
+            }});
+        }}
+        var shared = map.nycShared || (map.nycShared = {{}});
+        if (!shared[name]) {{
+            var sharedStyle = function(feature) {{
+                return layer.nycOverlay.style(feature);
+            }};
+            var layer = window.nycTiles && nycTiles.layers.indexOf(name) >= 0
+                ? nycTileLayer(name, options || {{}}, sharedStyle)
+                : nycLevelOfDetail(map, name, L.geoJson(null, L.extend({{}}, options, {{style: sharedStyle}})));
+            shared[name] = layer;
+        }}
+        return new nycOverlayClass(shared[name], style);
+    }}
+    {tile_script}
+</script>"""
+
+
+def shared_geometry_file(levels, topology=None):
+    """ Contents of the file a lazily loaded layer is fetched from, see `shared_geometry_script` """
+    return json.dumps({'levels': levels, 'topology': topology}, separators=(',', ':'))
+
+
+class SharedGeoJson(Layer):
+    """ GeoJSON layer drawn from the shared geometry with a fixed JS style function """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = nycLevelOfDetail({{ this._parent.get_name() }}, {{ this.geometry|tojson }}, L.geoJson(null, {
+                {%- if this.pane %}
+                pane: {{ this.pane|tojson }},
+                {%- endif %}
+                style: {{ this.style }}
+            }));
+        {% endmacro %}
+    """)
+
+    def __init__(self, geometry, style, name=None, pane=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'SharedGeoJson'
+        self.geometry = geometry
+        self.style = style
+        self.pane = pane
+
+
+class SharedChoropleth(Layer):
+    """ Choropleth that ships one class code per feature and colours the shared geometry
+
+    Every SharedChoropleth on the same geometry in a map restyles one shared
+    Leaflet layer, so switching between them doesn't rebuild any paths.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_codes = {{ this.codes|tojson }};
+            var {{ this.get_name() }}_colors = {{ this.colors|tojson }};
+            var {{ this.get_name() }} = nycOverlay({{ this._parent.get_name() }}, {{ this.geometry|tojson }}, function(feature) {
+                var code = {{ this.get_name() }}_codes.charAt(feature.id);
+                return {
+                    weight: {{ this.weight|tojson }},
+                    {%- if this.line_opacity is not none %}
+                    opacity: {{ this.line_opacity|tojson }},
+                    {%- endif %}
+                    color: 'black',
+                    fillOpacity: {{ this.fill_opacity|tojson }},
+                    fillColor: code === '-' ? {{ this.nan_fill_color|tojson }}
+                        : {{ this.get_name() }}_colors[parseInt(code, 36)]
+                };
+            }{% if this.pane %}, {pane: {{ this.pane|tojson }}}{% endif %});
+        {% endmacro %}
+    """)
+
+    def __init__(self, geometry, codes, colors, name=None, nan_fill_color='black', fill_opacity=0.6,
+                 line_opacity=1, weight=1, pane=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'SharedChoropleth'
+        self.geometry = geometry
+        self.codes = encode_codes(codes)
+        self.colors = list(colors)
+        self.nan_fill_color = nan_fill_color
+        self.fill_opacity = fill_opacity
+        self.line_opacity = line_opacity
+        self.weight = weight
+        self.pane = pane
+
+
+class RenderedElement(Element):
+    """ Page text rendered in another process, written out as is """
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class RenderedLayer(Layer):
+    """ A layer that was rendered elsewhere, standing in for it in its map and layer control
+
+    `parts` holds the (name, text) each page section received when the layer was rendered.
+    """
+
+    def __init__(self, layer, parts):
+        super().__init__(name=layer.layer_name, overlay=layer.overlay, control=layer.control, show=layer.show)
+        self._name = layer._name
+        self._id = layer._id
+        self.parts = parts
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        for section, rendered in self.parts.items():
+            for name, text in rendered:
+                getattr(figure, section).add_child(RenderedElement(text), name=name)
+
+
+class FrameTimer(MacroElement):
+    """ Logs how long the map's frames take while it pans or zooms, to compare renderers """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            (function(map, label) {
+                var frames = [];
+                var last = null;
+                var moving = false;
+                function tick(now) {
+                    if (last !== null) {
+                        frames.push(now - last);
+                    }
+                    last = now;
+                    if (moving) {
+                        requestAnimationFrame(tick);
+                    }
+                }
+                map.on('movestart zoomstart', function() {
+                    if (!moving) {
+                        moving = true;
+                        last = null;
+                        requestAnimationFrame(tick);
+                    }
+                });
+                map.on('moveend zoomend', function() {
+                    moving = false;
+                    if (!frames.length) {
+                        return;
+                    }
+                    frames.sort(function(a, b) { return a - b; });
+                    var mean = frames.reduce(function(a, b) { return a + b; }, 0) / frames.length;
+                    var p95 = frames[Math.min(frames.length - 1, Math.floor(frames.length * 0.95))];
+                    console.log(label + ': ' + frames.length + ' frames, mean ' + mean.toFixed(1) + ' ms, '
+                        + '95th percentile ' + p95.toFixed(1) + ' ms');
+                    frames = [];
+                });
+            })({{ this._parent.get_name() }}, {{ this.label|tojson }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, label):
+        super().__init__()
+        self._name = 'FrameTimer'
+        self.label = label
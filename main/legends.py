@@ -0,0 +1,54 @@
+import json
+
+
+def symbol_id(palette, classes):
+    return f'legend-{palette}-{classes}'
+
+
+def format_break(value):
+    """ Short legend label for a class edge, e.g. 632400 -> '632k' """
+    magnitude = abs(value)
+    for size, suffix in ((1e9, 'B'), (1e6, 'M'), (1e3, 'k')):
+        if magnitude >= size:
+            return f'{value / size:.3g}{suffix}'
+    return f'{value:.3g}'
+
+
+def legend_entry(title, edges, palette):
+    """ The per-layer legend data: its title and palette followed by one label per class edge """
+    return [title, palette] + [format_break(float(edge)) for edge in edges]
+
+
+def legend_symbols(palettes, opacity):
+    """ One hidden SVG holding a reusable <symbol> of class swatches per palette and size.
+
+    `palettes` maps each palette's name to its colour lists, one per number of classes.
+    """
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="0" height="0" style="position: absolute;">']
+    for palette, color_lists in palettes.items():
+        for colors in color_lists:
+            parts.append(f'<symbol id="{symbol_id(palette, len(colors))}" viewBox="0 0 {len(colors)} 1" '
+                         f'preserveAspectRatio="none">')
+            for i, color in enumerate(colors):
+                parts.append(f'<rect x="{i}" width="1" height="1" fill="{color}" fill-opacity="{opacity}" />')
+            parts.append('</symbol>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def legend_script(legend_data):
+    """ Legend labels for the page plus the function that draws one legend from them """
+    return f"""const legendData = {json.dumps(legend_data, separators=(',', ':'))};
+
+    function legendSvg(entry) {{
+        const [title, palette, ...labels] = entry;
+        const classes = labels.length - 1;
+        let svg = `<svg xmlns="http://www.w3.org/2000/svg" width="250" height="50" style="background-color: transparent;">
+            <use href="#{symbol_id('${palette}', '${classes}')}" x="25" y="20" width="200" height="10" />
+            <rect x="25" y="20" width="200" height="10" fill="none" stroke="black" stroke-width="1" />`;
+        labels.forEach((label, i) => {{
+            svg += `<text x="${{25 + 200 * i / classes}}" y="15" font-family="Arial" font-size="10" text-anchor="middle" fill="black">${{label}}</text>`;
+        }});
+        svg += `<text x="125" y="45" font-family="Arial" font-size="12" text-anchor="middle" fill="black">${{title}}</text></svg>`;
+        return svg;
+    }}"""
@@ -0,0 +1,284 @@
+import hashlib
+import itertools
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import folium
+from branca.element import CssLink, Element, JavascriptLink
+from branca.utilities import color_brewer
+
+from layers import FrameTimer, RenderedLayer, SharedChoropleth, SharedGeoJson
+
+BOUNDARY_STYLE = {
+    'fillColor': 'white',
+    'color': 'white',
+    'weight': 1,
+    'fillOpacity': 0,
+}
+
+
+# Stop and frisk, schools and parks are mapped on precincts, everything else on zipcodes
+def is_precinct_column(column):
+    return column.startswith('Black Stopped Rate') or column in ['Public Schools', 'Parks']
+
+
+# Name of a column's layer in the layer control, shared by every year
+def layer_label(column):
+    return re.sub(r'_\d{4}$', '', column).replace('_', ' ').title()
+
+
+@contextmanager
+def deterministic_ids(*seed):
+    """ Name the folium elements created inside the block from `seed` instead of at random.
+
+    folium gives every element (and so every JS variable) a random id, so no two
+    builds were alike. Seeding the ids per map and per layer makes the page the
+    same whichever process a layer was rendered in.
+    """
+    prefix = json.dumps(seed)
+    counter = itertools.count()
+    original = Element.__dict__['_generate_id']
+    Element._generate_id = classmethod(
+        lambda cls: hashlib.sha256(f'{prefix}:{next(counter)}'.encode()).hexdigest()[:32])
+    try:
+        yield
+    finally:
+        Element._generate_id = original
+
+
+# Add the mask for the five boroughs to the map
+def boundary_layer(boundary, shared_geometry):
+    if shared_geometry:
+        return SharedGeoJson(
+            'boundary',
+            style=f"function() {{ return {json.dumps(BOUNDARY_STYLE)}; }}",
+            overlay=False,
+            control=False
+        )
+    return folium.GeoJson(
+        boundary,
+        style_function=lambda x: BOUNDARY_STYLE,
+        overlay=False,
+        control=False
+    )
+
+
+# Add the redline JSON data as an overlay to the custom pane
+def redline_layer(redline, codes, palette, shared_geometry):
+    if shared_geometry:
+        return SharedChoropleth(
+            'redline',
+            codes=codes,
+            colors=palette,
+            name='Redlining Overlay',
+            fill_opacity=0.6,
+            line_opacity=None,
+            weight=0,
+            pane="redliningPane",
+            show=False
+        )
+    return folium.GeoJson(
+        redline[['fill', 'geometry']],
+        name='Redlining Overlay',
+        style_function=lambda feature: {
+            'fillColor': feature['properties'].get('fill', '#ff0000'),
+            'color': 'black',
+            'weight': 0,
+            'fillOpacity': 0.6,
+        },
+        pane="redliningPane",  # Assign to the custom pane
+        show=False
+    )
+
+
+# Function to create a choropleth layer
+def choropleth_layer(column, data, edges, codes, shared_geometry, palette='YlOrRd'):
+    is_precinct = is_precinct_column(column)
+    layer_name = layer_label(column)
+
+    # Only the class codes are written per layer, the shapes come from the shared geometry
+    if shared_geometry:
+        return SharedChoropleth(
+            'precincts' if is_precinct else 'zipcodes',
+            codes=codes,
+            colors=color_brewer(palette, n=len(edges) - 1),
+            name=layer_name,
+            fill_opacity=0.5,
+            line_opacity=0,
+            overlay=False,
+            show=False
+        )
+
+    choro = folium.Choropleth(
+        geo_data=data,
+        name=layer_name,
+        data=data,
+        columns=['modzcta' if not is_precinct else 'precinct', column],
+        key_on='feature.properties.precinct' if is_precinct else 'feature.properties.modzcta',
+        bins=list(edges),
+        fill_color=palette,
+        fill_opacity=0.5,
+        line_opacity=0,
+        overlay=False,
+        show=False  # Ensure the overlay is turned off by default
+    )
+
+    # Remove the color map added by folium's Choropleth
+    for key in list(choro._children):
+        if key.startswith('color_map'):
+            del (choro._children[key])
+
+    return choro
+
+
+def map_layers(columns, values, zipcodes, precincts, classes, boundary, redline, redline_codes, redline_palette,
+               shared_geometry=False, palette='YlOrRd'):
+    """ (name, build, args) of every layer of one year's map, in the order they are added
+
+    `values` holds each column's values in the row order of its geometry,
+    `zipcodes` or `precincts`. They are only joined when the geometry is inline.
+    Every choropleth is coloured with the ColorBrewer scheme `palette`.
+    """
+    if shared_geometry:
+        # Shared layers only need their class codes, don't ship the frames to the workers
+        zipcodes = precincts = boundary = redline = None
+
+    layers = [
+        ('boundary', boundary_layer, (boundary, shared_geometry)),
+        ('redline', redline_layer, (redline, redline_codes, redline_palette, shared_geometry)),
+    ]
+    for column in columns:
+        edges, codes = classes[column]
+        data = None
+        if not shared_geometry:
+            geometry, key = (precincts, 'precinct') if is_precinct_column(column) else (zipcodes, 'modzcta')
+            data = geometry[[key, 'geometry']].assign(**{column: values[column]})
+        layers.append((column, choropleth_layer, (column, data, edges, codes, shared_geometry, palette)))
+    return layers
+
+
+def render_layer(map_id, seed, build, args):
+    """ Build one layer and render it against a stand-in for its map """
+    with deterministic_ids(*seed):
+        layer = build(*args)
+        stand_in = folium.Map(tiles=None)
+        stand_in._id = map_id
+        stand_in.add_child(layer)
+        figure = stand_in.get_root()
+
+        sections = ('header', 'html', 'script')
+        existing = {section: set(getattr(figure, section)._children) for section in sections}
+        layer.render()
+        parts = {section: [(name, element.render())
+                           for name, element in getattr(figure, section)._children.items()
+                           if name not in existing[section]]
+                 for section in sections}
+        return RenderedLayer(layer, parts)
+
+
+# Function to create a folium map with its base tiles
+def map_shell(year, renderer='svg', width='50vw'):
+    with deterministic_ids(year, 'map'):
+        # Create a base map centered on NYC with white background.
+        # With preferCanvas every vector layer draws on a canvas per pane instead
+        # of one SVG node per polygon, the redline pane gets a canvas of its own
+        m = folium.Map(
+            location=[40.7128, -74.0060],
+            zoom_start=11,
+            tiles=None,
+            control_scale=True,
+            prefer_canvas=renderer == 'canvas',
+            width=width,
+            height="100vh"
+        )
+
+        # Set map size to 100%
+        m._size = (width, "100vh")
+
+        folium.TileLayer(
+            'cartodbpositron',
+            name='Light Map',
+            overlay=False,
+            control=False
+        ).add_to(m)
+    return m
+
+
+# Put a map's rendered layers together and return its (includes, HTML)
+def assemble_map(year, m, layers, columns, frame_times=None):
+    boundary, redline, *choropleths = layers
+    with deterministic_ids(year, 'assemble'):
+        m.add_child(boundary)
+
+        # Create a custom pane for Redlining Overlay
+        redlining_pane = folium.map.CustomPane("redliningPane", z_index=650)
+        m.add_child(redlining_pane)
+        m.add_child(redline)
+
+        for choropleth in choropleths:
+            m.add_child(choropleth)
+
+        # Add layer control with exclusive groups for choropleth layers
+        folium.LayerControl(collapsed=False, exclusiveGroups=columns).add_to(m)
+
+        if frame_times:
+            FrameTimer(f'{year} {frame_times}').add_to(m)
+
+        return map_fragment(m.get_root())
+
+
+def map_fragment(figure):
+    """ Render a map's figure as ([(name, library include)], HTML to embed in the page).
+
+    figure.render() would give a whole document with its own <head> loading
+    Leaflet and the other libraries, and every year map pasted in would load
+    them again. The includes are handed back separately instead, for the page
+    to load once, and the HTML only holds the map's own styles, container and
+    script.
+    """
+    for child in figure._children.values():
+        child.render()
+    includes = []
+    own = []
+    for name, element in figure.header._children.items():
+        if isinstance(element, (JavascriptLink, CssLink)) or name == 'meta_http':
+            includes.append((name, element.render()))
+        else:
+            own.append(element.render())
+    html = '\n'.join(own + [figure.html.render(), f'<script>\n{figure.script.render()}\n</script>'])
+    return includes, html
+
+
+def library_includes(maps):
+    """ HTML loading the libraries of every map, from assemble_map, each once and in order """
+    includes = {}
+    for map_includes, _ in maps:
+        for name, text in map_includes:
+            includes.setdefault(name, text)
+    return '\n    '.join(includes.values())
+
+
+def render_maps(maps, workers=1, renderer='svg', frame_times=False, width='50vw'):
+    """ (includes, HTML) of several year maps, given as {year: (columns, layers from map_layers)}.
+
+    Every layer is built and rendered as its own task, on `workers` processes
+    when there is more than one, and each map is put together from its layers
+    in order. The HTML is the same byte for byte whatever the number of workers.
+    With `frame_times` each map logs its frame times to the console as it moves.
+    Every map is `width` wide, a CSS length. The libraries the maps include are
+    left for the page to load once, see library_includes.
+    """
+    shells = {year: map_shell(year, renderer, width) for year in maps}
+    tasks = [(shells[year]._id, (year, name), build, args)
+             for year, (_, layers) in maps.items() for name, build, args in layers]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            rendered = iter(list(pool.map(render_layer, *zip(*tasks))))
+    else:
+        rendered = iter([render_layer(*task) for task in tasks])
+
+    return {year: assemble_map(year, shells[year], [next(rendered) for _ in layers], columns,
+                               renderer if frame_times else None)
+            for year, (columns, layers) in maps.items()}
@@ -0,0 +1,87 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressed copies that can be written next to a file, by extension
+COMPRESSIONS = ('gz', 'br')
+
+
+class CompressedWriter:
+    """ Text file written to `path` and, for each extension in `compressions`, to a compressed copy next to it.
+
+    Every chunk is encoded once and passed on to all the files as it comes, so
+    a page written chunk by chunk is never held whole, in any encoding. Servers
+    that send precompressed files (gzip_static, brotli_static and the like)
+    pick up the copies. The files only replace the earlier ones when closed;
+    leaving a `with` block on an error keeps the earlier ones. Raises
+    ValueError for 'br' without the brotli package.
+    """
+
+    def __init__(self, path, compressions=()):
+        unknown = [name for name in compressions if name not in COMPRESSIONS]
+        if unknown:
+            raise ValueError(f"unknown compression {', '.join(unknown)}, expected some of {', '.join(COMPRESSIONS)}")
+        if 'br' in compressions and brotli is None:
+            raise ValueError("writing .br files needs the brotli package, pip install brotli")
+        self.path = path
+        self.compressions = compressions
+        # Everything is written next to its final name and only swapped in once complete
+        self.temporaries = {}
+        self.files = [self._open(path)]
+        self.gzip = None
+        self.brotli = None
+        if 'gz' in compressions:
+            self.files.append(self._open(path + '.gz'))
+            # No name or time in the header, the same text gives the same bytes
+            self.gzip = gzip.GzipFile(filename='', mode='wb', fileobj=self.files[-1], compresslevel=9, mtime=0)
+        if 'br' in compressions:
+            self.files.append(self._open(path + '.br'))
+            self.brotli_file = self.files[-1]
+            self.brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+
+    def _open(self, path):
+        self.temporaries[path] = f'{path}.{os.getpid()}.tmp'
+        return open(self.temporaries[path], 'wb')
+
+    def write(self, text):
+        data = text.encode()
+        self.files[0].write(data)
+        if self.gzip:
+            self.gzip.write(data)
+        if self.brotli:
+            self.brotli_file.write(self.brotli.process(data))
+
+    def close(self):
+        """ Finish the files and put them in place of the earlier ones, together """
+        if self.gzip:
+            self.gzip.close()
+        if self.brotli:
+            self.brotli_file.write(self.brotli.finish())
+        for f in self.files:
+            f.close()
+        for path, temporary in self.temporaries.items():
+            os.replace(temporary, path)
+        # A copy left from an earlier run would be sent in place of the new file
+        for name in COMPRESSIONS:
+            if name not in self.compressions and os.path.exists(f'{self.path}.{name}'):
+                os.remove(f'{self.path}.{name}')
+
+    def discard(self):
+        """ Drop what was written, leaving the earlier files as they were """
+        for f in self.files:
+            f.close()
+        for temporary in self.temporaries.values():
+            os.remove(temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
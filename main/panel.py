@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Index levels of the panel, a block of rows per (geography, indicator, year)
+PANEL_INDEX = ['geography', 'indicator', 'year']
+
+
+def panel_block(geography, ids, year, indicators, values):
+    """ Long-format rows of one year of `indicators` for one geography.
+
+    `values` is a (features x indicators) array whose rows are in the order of
+    `ids`, the order of the geometry, so a block lines up with the geometry it
+    is drawn on.
+    """
+    ids = pd.Index(ids)
+    values = np.asarray(values, dtype=np.float32)
+    return {
+        'geography': np.full(values.size, geography, dtype=object),
+        'geo_id': np.tile(ids.astype(str).to_numpy(dtype=object), len(indicators)),
+        'indicator': np.repeat(np.asarray(indicators, dtype=object), len(ids)),
+        'year': np.full(values.size, year, dtype=np.int16),
+        # Column-major so each indicator's values stay together
+        'value': values.ravel(order='F'),
+    }
+
+
+def build_panel(blocks):
+    """ One long-format frame of every indicator, year and geography.
+
+    Ids, geographies and indicators are categoricals, years int16 and values
+    float32; there is no geometry. The frame is sorted on PANEL_INDEX, so a
+    block is found by binary search, see `panel_values`.
+    """
+    columns = {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+    panel = pd.DataFrame({
+        'geography': pd.Categorical(columns['geography']),
+        'geo_id': pd.Categorical(columns['geo_id']),
+        'indicator': pd.Categorical(columns['indicator']),
+        'year': columns['year'],
+        'value': columns['value'],
+    })
+    # A stable sort keeps each block in geometry order
+    return panel.sort_values(PANEL_INDEX, kind='stable').set_index(PANEL_INDEX)
+
+
+def panel_values(panel, geography, indicator, year):
+    """ Values of one indicator in one year, in the geometry's row order """
+    return panel.loc[(geography, indicator, year), 'value'].to_numpy(dtype=float)
+
+
+def panel_columns(panel, geography):
+    """ {'Indicator_YYYY': values} of every indicator and year of one geography, in the geometry's row order """
+    block = panel.xs(geography, level='geography')['value']
+    return {f'{indicator}_{year}': block.loc[(indicator, year)].to_numpy(dtype=float)
+            for indicator, year in block.index.unique()}
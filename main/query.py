@@ -0,0 +1,108 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def containing_positions(geometries, x, y):
+    """ Position of the first polygon of `geometries` containing each point, -1 where none does.
+
+    The points are sorted on x once; every polygon then only tests the points
+    inside its bounding box, found by binary search, against its prepared
+    geometry in one vectorized call.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    shapely.prepare(geometries)
+    bounds = shapely.bounds(geometries)
+    order = np.argsort(x, kind='stable')
+    starts = np.searchsorted(x[order], bounds[:, 0], side='left')
+    ends = np.searchsorted(x[order], bounds[:, 2], side='right')
+
+    positions = np.full(len(x), -1)
+    for i, geometry in enumerate(geometries):
+        if geometry is None:
+            continue
+        candidates = order[starts[i]:ends[i]]
+        inside = (y[candidates] >= bounds[i, 1]) & (y[candidates] <= bounds[i, 3]) & (positions[candidates] < 0)
+        candidates = candidates[inside]
+        positions[candidates[shapely.contains_xy(geometry, x[candidates], y[candidates])]] = i
+    return positions
+
+
+class PointLookup:
+    """ Finds the ZCTA, precinct and HOLC area of points and reads their indicators for every year.
+
+    `indicators` maps 'zipcodes' and 'precincts' to the indicators read from
+    the panel for the area a point falls in, e.g. the census columns for its
+    ZCTA and the stop and frisk ones for its precinct.
+    """
+
+    def __init__(self, zipcodes, precincts, redline, panel, indicators):
+        self.geometries = {
+            'zipcodes': zipcodes.geometry.to_numpy(),
+            'precincts': precincts.geometry.to_numpy(),
+            'redline': redline.geometry.to_numpy(),
+        }
+        # A trailing missing value is what position -1 reads
+        self.ids = {
+            'modzcta': np.append(zipcodes['modzcta'].to_numpy(dtype=object), None),
+            'precinct': np.append(precincts['precinct'].to_numpy(dtype=object), None),
+            'holc_grade': np.append(redline['grade'].to_numpy(dtype=object), None),
+        }
+        self.columns = {}
+        self.values = {}
+        for geography, names in indicators.items():
+            block = panel.xs(geography, level='geography')['value']
+            keys = [(indicator, year) for indicator, year in block.index.unique() if indicator in names]
+            self.columns[geography] = [f'{indicator}_{year}' for indicator, year in keys]
+            table = np.column_stack([block.loc[key].to_numpy(dtype=float) for key in keys])
+            self.values[geography] = np.vstack([table, np.full(len(keys), np.nan)])
+
+    def locate(self, lat, lon):
+        """ {layer: positions} of the ZCTA, precinct and HOLC area containing each point, -1 outside all of them """
+        x = np.asarray(lon, dtype=float)
+        y = np.asarray(lat, dtype=float)
+        return {name: containing_positions(geometries, x, y) for name, geometries in self.geometries.items()}
+
+    def lookup(self, lat, lon):
+        """ One row per point: its MODZCTA, precinct, HOLC grade and an 'Indicator_YYYY' column per year """
+        positions = self.locate(lat, lon)
+        columns = {
+            'modzcta': self.ids['modzcta'][positions['zipcodes']],
+            'precinct': self.ids['precinct'][positions['precincts']],
+            'holc_grade': self.ids['holc_grade'][positions['redline']],
+        }
+        for geography, names in self.columns.items():
+            values = self.values[geography][positions[geography]]
+            columns.update(zip(names, values.T))
+        return pd.DataFrame(columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up the areas and indicators of points in a CSV file')
+    parser.add_argument('points', help='CSV file with a latitude and a longitude column')
+    parser.add_argument('-o', '--output', default=sys.stdout, help='where to write the result, standard output by default')
+    parser.add_argument('--lat', default='lat', help="name of the latitude column (default 'lat')")
+    parser.add_argument('--lon', default='lon', help="name of the longitude column (default 'lon')")
+    args = parser.parse_args()
+
+    # Loading the sources goes through the build's cache, run from the main folder
+    from base import base_columns, load_inputs, stop_frisk_indicators
+    from redlining import REDLINING_INDICATORS
+    inputs = load_inputs()
+    lookup = PointLookup(inputs.zipcodes, inputs.precincts, inputs.redline, inputs.panel,
+                         {'zipcodes': base_columns + REDLINING_INDICATORS, 'precincts': stop_frisk_indicators})
+
+    points = pd.read_csv(args.points)
+    start = time.perf_counter()
+    result = lookup.lookup(points[args.lat].to_numpy(), points[args.lon].to_numpy())
+    elapsed = time.perf_counter() - start
+    pd.concat([points, result.set_index(points.index)], axis=1).to_csv(args.output, index=False)
+    print(f"{len(points)} points looked up in {elapsed:.2f} s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
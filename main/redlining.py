@@ -0,0 +1,36 @@
+import numpy as np
+import shapely
+
+from crosswalk import AREA_CRS, intersection_areas
+
+# HOLC grades from best to worst, scored 1 to 4
+HOLC_GRADES = ('A', 'B', 'C', 'D')
+
+# The HOLC drew its maps of New York in 1938, the panel files the measures under that year
+REDLINING_YEAR = 1938
+
+# Indicators computed for every ZCTA and precinct
+REDLINING_INDICATORS = [f'Grade {grade} Share' for grade in HOLC_GRADES] + ['Redlining Score']
+
+
+def redlining_measures(units, redline, grades):
+    """ (units x REDLINING_INDICATORS) array of how much of each unit the HOLC graded, and how.
+
+    The share of a unit's area in each grade is in percent. The score is the
+    area-weighted mean grade over the graded part, from 1 (all A) to 4 (all D),
+    and NaN for units the HOLC never mapped. `units` and `redline` are
+    GeoSeries, `grades` the grade of each redline polygon; other grades (E,
+    missing) are left out.
+    """
+    units = units.to_crs(AREA_CRS).to_numpy()
+    unit_index, redline_index, areas = intersection_areas(units, redline.to_crs(AREA_CRS).to_numpy())
+
+    codes = np.array([HOLC_GRADES.index(grade) if grade in HOLC_GRADES else -1 for grade in grades])[redline_index]
+    graded = codes >= 0
+    grade_areas = np.zeros((len(units), len(HOLC_GRADES)))
+    np.add.at(grade_areas, (unit_index[graded], codes[graded]), areas[graded])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = grade_areas / shapely.area(units)[:, None] * 100
+        score = grade_areas @ np.arange(1, len(HOLC_GRADES) + 1) / grade_areas.sum(axis=1)
+    return np.column_stack([shares, score])
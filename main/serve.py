@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import cache
+
+# Query parameters of /map, `layer` picks the overlays like --indicators
+PAGE_PARAMETERS = {'years', 'compare', 'changes', 'layer', 'scheme', 'classes'}
+
+# A response body as sent and gzipped, with its ETag
+Payload = namedtuple('Payload', ['content_type', 'body', 'gzipped', 'etag', 'cache_control', 'layers'])
+
+
+def payload(body, content_type, cache_control='no-cache', layers=()):
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return Payload(content_type, body, gzip.compress(body, compresslevel=6, mtime=0), f'"{digest}"', cache_control,
+                   tuple(layers))
+
+
+class LRUCache:
+    """ Mapping that drops the least recently used entries once they add up to more than `max_bytes`.
+
+    The page builder's thread and the event loop both use it, every access
+    holds a lock.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.size -= dropped
+
+
+class ResidentStore:
+    """ Build artifacts kept in memory in front of the disk cache, a `store` for build_page """
+
+    def __init__(self, lru):
+        self.lru = lru
+
+    def is_cached(self, name, key):
+        return (name, key) in self.lru or cache.is_cached(name, key)
+
+    def cached(self, name, key, build):
+        value = self.lru.get((name, key))
+        if value is None:
+            value = cache.cached(name, key, build)
+            self.lru.put((name, key), value, len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        return value
+
+
+def accepts_gzip(header):
+    """ Whether an Accept-Encoding header allows gzip """
+    for coding in header.split(','):
+        name, _, parameters = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            quality = parameters.strip()
+            return not quality.startswith('q=') or float(quality[2:] or 0) > 0
+    return False
+
+
+def matches(header, etag):
+    """ Whether an If-None-Match header names `etag`, compared weakly """
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+class MapServer:
+    """ Serves pages of any years and overlays from data loaded once.
+
+    Pages with the layers they fetch, and the maps and geometry they are
+    built from, are kept in one LRUCache of `cache_bytes`, so repeated
+    requests are answered from memory. A page's size counts its layers, a
+    layer is served while a page that fetches it is cached. Pages are built one at a time on a thread, folium
+    names its elements through a class-wide hook while a map renders.
+    """
+
+    def __init__(self, inputs, cache_bytes, workers=1):
+        self.inputs = inputs
+        # 0 renders on every CPU, like base.py's --workers
+        self.workers = workers or os.cpu_count()
+        self.lru = LRUCache(cache_bytes)
+        self.store = ResidentStore(self.lru)
+        self.builder = ThreadPoolExecutor(1)
+        self.building = {}
+        # Keys of the pages that fetch each layer path
+        self.layer_pages = {}
+
+    def page_args(self, query):
+        """ Arguments of build_page for a /map query, ValueError for anything it doesn't take """
+        from base import parser
+        from classify import SCHEMES, class_count
+
+        params = parse_qs(query, keep_blank_values=True)
+        unknown = sorted(set(params) - PAGE_PARAMETERS)
+        if unknown:
+            raise ValueError(f"unknown parameter {', '.join(unknown)}, expected some of "
+                             f"{', '.join(sorted(PAGE_PARAMETERS))}")
+
+        def listed(name):
+            return ','.join(params[name]).split(',') if name in params else None
+
+        args = parser.parse_args(['--layers', 'lazy'])
+        args.years = listed('years')
+        args.compare = listed('compare')
+        args.changes = listed('changes') or args.changes
+        args.indicators = listed('layer')
+        if 'scheme' in params:
+            args.scheme = params['scheme'][-1]
+            if args.scheme not in SCHEMES:
+                raise ValueError(f"unknown scheme {args.scheme}, expected one of {', '.join(SCHEMES)}")
+        if 'classes' in params:
+            args.classes = class_count(params['classes'][-1])
+        return args
+
+    def build(self, args):
+        from base import build_page
+
+        layers = {}
+
+        def write_layer(name, text):
+            layer = payload(text.encode(), 'application/json', 'public, max-age=31536000, immutable')
+            path = f'/layers/{name}-{layer.etag.strip(chr(34))}.json'
+            # Pages with the same geometry share one copy of it
+            layers[path] = self.layer(path) or layer
+            return path.lstrip('/')
+
+        html = ''.join(build_page(args, self.inputs, self.workers, self.store, write_layer))
+        return payload(html.encode(), 'text/html; charset=utf-8', layers=layers.items())
+
+    async def page(self, query):
+        args = self.page_args(query)
+        key = ('page', tuple(args.years or ()), tuple(args.compare or ()), tuple(args.changes),
+               tuple(sorted({indicator.strip().lower() for indicator in args.indicators or ()})),
+               args.scheme, args.classes)
+        page = self.lru.get(key)
+        if page is None:
+            # Requests for a page being built wait on the same build
+            if key not in self.building:
+                self.building[key] = asyncio.get_running_loop().run_in_executor(self.builder, self.build, args)
+            try:
+                page = await self.building[key]
+            finally:
+                self.building.pop(key, None)
+            size = sum(len(resource.body) + len(resource.gzipped) for resource in (page, *dict(page.layers).values()))
+            self.lru.put(key, page, size)
+            for path, _ in page.layers:
+                self.layer_pages.setdefault(path, set()).add(key)
+        return page
+
+    def layer(self, path):
+        """ Payload of a layer fetched by a cached page, None once all those pages are dropped """
+        for key in list(self.layer_pages.get(path, ())):
+            page = self.lru.get(key)
+            if page is not None:
+                return dict(page.layers)[path]
+            self.layer_pages[path].discard(key)
+        return None
+
+    async def respond(self, method, target, headers):
+        """ (status, headers, body) of one request """
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, b''
+        url = urlsplit(target)
+        try:
+            if url.path in ('/', '/map'):
+                resource = await self.page(url.query)
+            elif url.path.startswith('/layers/'):
+                resource = self.layer(url.path)
+            else:
+                resource = None
+        except ValueError as error:
+            return 400, {'Content-Type': 'text/plain; charset=utf-8'}, f'{error}\n'.encode()
+        if resource is None:
+            return 404, {'Content-Type': 'text/plain; charset=utf-8'}, b'Not found\n'
+
+        compressed = accepts_gzip(headers.get('accept-encoding', ''))
+        etag = resource.etag[:-1] + '-gzip"' if compressed else resource.etag
+        response = {'ETag': etag, 'Cache-Control': resource.cache_control, 'Vary': 'Accept-Encoding'}
+        if matches(headers.get('if-none-match', ''), etag):
+            return 304, response, b''
+        response['Content-Type'] = resource.content_type
+        if compressed:
+            response['Content-Encoding'] = 'gzip'
+        return 200, response, resource.gzipped if compressed else resource.body
+
+    async def handle(self, reader, writer):
+        """ Answer the requests of one connection, kept open between them unless the client closes it """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                except ValueError:
+                    method, target, version, headers = None, None, 'HTTP/1.0', {}
+                    status, response, body = 400, {'Content-Type': 'text/plain; charset=utf-8'}, b'Bad request\n'
+                else:
+                    try:
+                        status, response, body = await self.respond(method, target, headers)
+                    except Exception as error:
+                        print(f"{method} {target} failed: {error!r}", file=sys.stderr)
+                        status, response, body = 500, {'Content-Type': 'text/plain; charset=utf-8'}, b'Error\n'
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                response['Content-Length'] = str(len(body))
+                response['Connection'] = 'keep-alive' if keep_alive else 'close'
+                reason = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+                          405: 'Method Not Allowed', 500: 'Internal Server Error'}[status]
+                head = f'HTTP/1.1 {status} {reason}\r\n' + ''.join(f'{name}: {value}\r\n'
+                                                                  for name, value in response.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + (b'' if method == 'HEAD' or status == 304 else body))
+                await writer.drain()
+                print(f"{method} {target} {status} {len(body)} B {(time.perf_counter() - start) * 1000:.1f} ms",
+                      file=sys.stderr)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server, host, port):
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving on http://{host}:{port}/map?years=2011,2022", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the map of any years and overlays without rebuilding it')
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default 8000)')
+    parser.add_argument('--cache-mb', type=int, default=512,
+                        help='memory kept for pages, layers and the maps they are built from (default 512)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes the map layers of a new page are rendered on, 0 for one per CPU')
+    args = parser.parse_args()
+
+    # The geometry and the panel stay in memory, loaded through the build's cache, run from the main folder
+    from base import load_inputs
+    server = MapServer(load_inputs(), args.cache_mb * 2 ** 20, args.workers)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import os
+import time
+
+import cache
+
+
+def test_prune_removes_entries_no_build_loaded(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    cache.cached('used', 'a', lambda: 1)
+    cache.cached('unused', 'b', lambda: 2)
+    (tmp_path / 'digests.json').write_text('{}')
+    old = time.time() - 40 * 24 * 60 * 60
+    for path in tmp_path.iterdir():
+        os.utime(path, (old, old))
+
+    # Loading an entry marks it as used
+    assert cache.cached('used', 'a', lambda: None) == 1
+    assert cache.prune(30) > 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['digests.json', 'used-a.pkl']
+
+
+def test_prune_without_cache(monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', None)
+    assert cache.prune() == 0
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import re
+
+import cache
+from serve import MapServer
+
+
+def test_workers_default_to_one_per_cpu():
+    assert MapServer(None, 2 ** 20, 0).workers == os.cpu_count()
+    assert MapServer(None, 2 ** 20).workers == 1
+
+
+def test_page_renders_on_every_cpu(monkeypatch):
+    # The data is found from the main folder, and with the cache off every layer is rendered
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setattr(cache, 'CACHE_DIR', None)
+    from base import load_inputs
+
+    server = MapServer(load_inputs(), 2 ** 28, 0)
+    status, headers, body = asyncio.run(server.respond('GET', '/map?years=2022&layer=Population', {}))
+    assert status == 200
+    assert body.startswith(b'\n<!DOCTYPE html>')
+
+
+def test_layers_are_counted_with_their_page(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setattr(cache, 'CACHE_DIR', None)
+    from base import load_inputs
+    server = MapServer(load_inputs(), 2 ** 28)
+    status, _, body = asyncio.run(server.respond('GET', '/map?years=2022&layer=Population', {}))
+    path = '/' + re.search(rb'layers/[^"\']+\.json', body).group().decode()
+    status, _, layer = asyncio.run(server.respond('GET', path, {}))
+    assert status == 200
+    page, size = next(entry for key, entry in server.lru.entries.items() if key[0] == 'page')
+    assert size >= len(page.body) + len(layer)
+    # Once its page is dropped the layer is gone too
+    server.lru.entries.clear()
+    assert asyncio.run(server.respond('GET', path, {}))[0] == 404
@@ -0,0 +1,699 @@
+import gzip
+import json
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from geometry import simplify
+
+# Tiles are cut in Web Mercator, the world is WORLD metres across
+TILE_CRS = 'EPSG:3857'
+WORLD = 2 * 20037508.342789244
+
+# Size of a tile's coordinate grid, and how far past its edges polygons are kept so no seams show
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Zoom levels written to the archive. The whole city fits in a tile or two below
+# zoom 8, the page scales those down, and it draws closer zooms from the last one
+TILE_ZOOMS = range(8, 15)
+
+# Tiles rendered per task
+TILE_CHUNK = 64
+
+# The header and root directory of a PMTiles archive fit in its first 16 KiB
+PMTILES_HEADER = struct.Struct('<7sB11Q6B4iB2i')
+PMTILES_ROOT = 16384
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number, payload):
+    """ A length-delimited protobuf field """
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _packed(values):
+    """ Varints of a run of small unsigned integers (below 2 ** 35), back to back """
+    values = np.asarray(values, dtype=np.uint64).reshape(-1, 1)
+    shifts = np.arange(5, dtype=np.uint64) * np.uint64(7)
+    groups = (values >> shifts) & np.uint64(0x7F)
+    lengths = 1 + np.sum(values >= np.uint64(1) << shifts[1:], axis=1, keepdims=True)
+    position = np.arange(5)
+    groups |= np.where(position < lengths - 1, np.uint64(0x80), np.uint64(0))
+    return groups[position < lengths].astype(np.uint8).tobytes()
+
+
+def _value(value):
+    """ An MVT Value message """
+    if isinstance(value, str):
+        return _field(1, value.encode())
+    if isinstance(value, bool):
+        return _varint(7 << 3) + _varint(int(value))
+    if isinstance(value, int):
+        return _varint(5 << 3) + _varint(value) if value >= 0 else _varint(6 << 3) + _varint(-2 * value - 1)
+    return _varint(3 << 3 | 1) + struct.pack('<d', value)
+
+
+def _ring(coords, exterior):
+    """ A ring on the tile grid without its closing point, wound as MVT wants, or None once it collapses.
+
+    In tile coordinates (y down) exterior rings have a positive area and holes
+    a negative one.
+    """
+    points = np.rint(coords[:-1]).astype(np.int64)
+    points = points[np.any(points != np.concatenate([points[-1:], points[:-1]]), axis=1)]
+    if len(points) < 3:
+        return None
+    x, y = points.T
+    area = int(x[:-1] @ y[1:] - x[1:] @ y[:-1]) + int(x[-1] * y[0] - x[0] * y[-1])
+    if area == 0:
+        return None
+    return points if (area > 0) == exterior else points[::-1]
+
+
+def _geometry(rings):
+    """ The MoveTo, LineTo and ClosePath commands drawing `rings`, with zigzag encoded deltas """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for ring in rings:
+        deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+        cursor = ring[-1]
+        deltas = np.where(deltas >= 0, deltas * 2, -deltas * 2 - 1).ravel().tolist()
+        commands += [1 | 1 << 3] + deltas[:2] + [2 | (len(ring) - 1) << 3] + deltas[2:] + [7 | 1 << 3]
+    return commands
+
+
+def tile_layer(geometries, attributes, coverage=True):
+    """ One layer of the tiles: its geometry in TILE_CRS and {attribute: values}, missing values left out.
+
+    `geometries` is a GeoSeries; a feature's id in the tiles is its row
+    position, which is where the page looks up its class code. Coverages
+    (like ZCTAs) are simplified so neighbours stay gap-free.
+    """
+    columns = {name: [None if pd.isna(value) else value for value in pd.Series(values).tolist()]
+               for name, values in attributes.items()}
+    return geometries.to_crs(TILE_CRS).to_numpy(), columns, coverage
+
+
+# Attributes of the layers being rendered, their geometry at each zoom and STRtrees over it, per process
+_tile_layers = {}
+_zoom_geometry = {}
+_trees = {}
+
+
+def _set_tile_layers(layers, simplified=None):
+    _tile_layers.clear()
+    _tile_layers.update(layers)
+    _zoom_geometry.clear()
+    _trees.clear()
+    for zoom, geometries in (simplified or {}).items():
+        for name, layer_geometries in geometries.items():
+            _zoom_geometry[name, zoom] = layer_geometries
+
+
+def _simplify_zoom(zoom):
+    """ Every layer simplified to one unit of the tile grid at `zoom` """
+    return {name: simplify(geometries, WORLD / 2 ** zoom / TILE_EXTENT, coverage)
+            for name, (geometries, _, coverage) in _tile_layers.items()}
+
+
+def _geometry_for_zoom(name, zoom):
+    if (name, zoom) not in _trees:
+        _trees[name, zoom] = shapely.STRtree(_zoom_geometry[name, zoom])
+    return _zoom_geometry[name, zoom], _trees[name, zoom]
+
+
+def render_tile(zoom, x, y):
+    """ A Mapbox Vector Tile of every layer, gzipped, or None when nothing is in it """
+    size = WORLD / 2 ** zoom
+    left = x * size - WORLD / 2
+    top = WORLD / 2 - y * size
+    buffer = size * TILE_BUFFER / TILE_EXTENT
+    box = (left - buffer, top - size - buffer, left + size + buffer, top + buffer)
+    scale = TILE_EXTENT / size
+
+    layers = []
+    for name, (_, columns, _) in _tile_layers.items():
+        geometries, tree = _geometry_for_zoom(name, zoom)
+        hits = np.sort(tree.query(shapely.box(*box)))
+        keys, values, features = {}, {}, []
+        # Cut to the tile, moved onto its grid and snapped to it without leaving self-intersections
+        clipped = shapely.clip_by_rect(geometries[hits], *box)
+        on_grid = shapely.set_precision(
+            shapely.transform(clipped, lambda coords: (coords - (left, top)) * (scale, -scale)), 1)
+        for position, geometry in zip(hits.tolist(), on_grid):
+            rings = []
+            for polygon in shapely.get_parts(geometry):
+                if shapely.get_type_id(polygon) != shapely.GeometryType.POLYGON or polygon.is_empty:
+                    continue
+                parts = [shapely.get_exterior_ring(polygon)] + [
+                    shapely.get_interior_ring(polygon, i) for i in range(shapely.get_num_interior_rings(polygon))]
+                polygon_rings = []
+                for i, part in enumerate(parts):
+                    ring = _ring(shapely.get_coordinates(part), i == 0)
+                    if ring is None and i == 0:
+                        break
+                    if ring is not None:
+                        polygon_rings.append(ring)
+                rings += polygon_rings
+            if not rings:
+                continue
+
+            tags = []
+            for key, column in columns.items():
+                value = column[position]
+                if value is None:
+                    continue
+                tags += [keys.setdefault(key, len(keys)), values.setdefault((type(value), value), len(values))]
+            features.append(_varint(1 << 3) + _varint(position) + _field(2, _packed(tags))
+                            + _varint(3 << 3) + _varint(3) + _field(4, _packed(_geometry(rings))))
+
+        if features:
+            layers.append(_field(3, _varint(15 << 3) + _varint(2) + _field(1, name.encode())
+                                 + b''.join(_field(2, feature) for feature in features)
+                                 + b''.join(_field(3, key.encode()) for key in keys)
+                                 + b''.join(_field(4, _value(value)) for _, value in values)
+                                 + _varint(5 << 3) + _varint(TILE_EXTENT)))
+    if not layers:
+        return None
+    return gzip.compress(b''.join(layers), mtime=0)
+
+
+def tile_id(zoom, x, y):
+    """ Position of a tile in a PMTiles archive: tiles of lower zooms, then along a Hilbert curve """
+    position = (4 ** zoom - 1) // 3
+    for level in reversed(range(zoom)):
+        side = 1 << level
+        rx, ry = int(x & side > 0), int(y & side > 0)
+        position += side * side * (3 * rx ^ ry)
+        x, y = x & side - 1, y & side - 1
+        if ry == 0:
+            if rx == 1:
+                x, y = side - 1 - x, side - 1 - y
+            x, y = y, x
+    return position
+
+
+def _render_chunk(zoom, tiles):
+    return [(tile_id(zoom, x, y), data) for x, y in tiles for data in [render_tile(zoom, x, y)] if data]
+
+
+def tile_ranges(bounds, zooms=TILE_ZOOMS):
+    """ {zoom: [(x, y), ...]} of the tiles covering `bounds`, given in TILE_CRS """
+    ranges = {}
+    for zoom in zooms:
+        size = WORLD / 2 ** zoom
+        last = 2 ** zoom - 1
+        columns = np.clip(np.floor((np.array(bounds[0::2]) + WORLD / 2) / size), 0, last).astype(int)
+        rows = np.clip(np.floor((WORLD / 2 - np.array(bounds[3:0:-2])) / size), 0, last).astype(int)
+        ranges[zoom] = [(x, y) for x in range(columns[0], columns[1] + 1) for y in range(rows[0], rows[1] + 1)]
+    return ranges
+
+
+def render_tiles(layers, zooms=TILE_ZOOMS, workers=1):
+    """ {tile id: gzipped MVT} of every tile with something in it, layers given as {name: tile_layer}.
+
+    Every layer is simplified once per zoom, the zooms in parallel, then each
+    run of TILE_CHUNK tiles of a zoom is rendered as its own task. Both steps
+    run on `workers` processes when there is more than one.
+    """
+    zooms = list(zooms)
+    bounds = shapely.total_bounds(np.concatenate([geometries for geometries, _, _ in layers.values()]))
+    tasks = [(zoom, tiles[start:start + TILE_CHUNK])
+             for zoom, tiles in tile_ranges(bounds, zooms).items() for start in range(0, len(tiles), TILE_CHUNK)]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(zooms)), initializer=_set_tile_layers, initargs=(layers,)) as pool:
+            simplified = dict(zip(zooms, pool.map(_simplify_zoom, zooms)))
+        # The tile tasks only need the attributes and the simplified geometry
+        attributes = {name: (None, columns, coverage) for name, (_, columns, coverage) in layers.items()}
+        with ProcessPoolExecutor(min(workers, len(tasks)), initializer=_set_tile_layers,
+                                 initargs=(attributes, simplified)) as pool:
+            rendered = list(pool.map(_render_chunk, *zip(*tasks)))
+    else:
+        _set_tile_layers(layers)
+        _set_tile_layers(layers, {zoom: _simplify_zoom(zoom) for zoom in zooms})
+        rendered = [_render_chunk(*task) for task in tasks]
+    _set_tile_layers({})
+    return dict(sorted(tile for chunk in rendered for tile in chunk))
+
+
+def _directory(entries):
+    """ A gzipped PMTiles directory of [tile id, offset, length, run length] entries """
+    out = [_varint(len(entries))]
+    previous = 0
+    for entry in entries:
+        out.append(_varint(entry[0] - previous))
+        previous = entry[0]
+    out += [_varint(entry[3]) for entry in entries]
+    out += [_varint(entry[2]) for entry in entries]
+    for i, entry in enumerate(entries):
+        contiguous = i > 0 and entry[1] == entries[i - 1][1] + entries[i - 1][2]
+        out.append(_varint(0 if contiguous else entry[1] + 1))
+    return gzip.compress(b''.join(out), mtime=0)
+
+
+def _directories(entries):
+    """ (root, leaves) directories, the entries are spread over leaves when the root would not fit """
+    root = _directory(entries)
+    if len(root) <= PMTILES_ROOT - PMTILES_HEADER.size:
+        return root, b''
+    leaf_size = 4096
+    while True:
+        leaves = bytearray()
+        root_entries = []
+        for start in range(0, len(entries), leaf_size):
+            leaf = _directory(entries[start:start + leaf_size])
+            root_entries.append([entries[start][0], len(leaves), len(leaf), 0])
+            leaves += leaf
+        root = _directory(root_entries)
+        if len(root) <= PMTILES_ROOT - PMTILES_HEADER.size:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+
+def pmtiles_archive(tiles, layers, bounds, zooms=TILE_ZOOMS, name=''):
+    """ A PMTiles (version 3) archive of `tiles` from render_tiles, as bytes.
+
+    `layers` is what the tiles were rendered from and fills in the metadata;
+    `bounds` are (west, south, east, north) in degrees. Identical tiles, like
+    the ones all in one polygon, are stored once.
+    """
+    data = bytearray()
+    offsets = {}
+    entries = []
+    for tile, content in tiles.items():
+        if content not in offsets:
+            offsets[content] = len(data)
+            data += content
+        offset = offsets[content]
+        if entries and entries[-1][1] == offset and entries[-1][0] + entries[-1][3] == tile:
+            entries[-1][3] += 1
+        else:
+            entries.append([tile, offset, len(content), 1])
+    root, leaves = _directories(entries)
+
+    metadata = gzip.compress(json.dumps({
+        'name': name,
+        'format': 'pbf',
+        'vector_layers': [{
+            'id': layer_name,
+            'fields': {key: 'String' if any(isinstance(value, str) for value in column) else 'Number'
+                       for key, column in columns.items()},
+            'minzoom': min(zooms),
+            'maxzoom': max(zooms),
+        } for layer_name, (_, columns, _) in layers.items()],
+    }, separators=(',', ':')).encode(), mtime=0)
+
+    root_offset = PMTILES_HEADER.size
+    metadata_offset = root_offset + len(root)
+    leaves_offset = metadata_offset + len(metadata)
+    data_offset = leaves_offset + len(leaves)
+    west, south, east, north = (round(value * 1e7) for value in bounds)
+    header = PMTILES_HEADER.pack(
+        b'PMTiles', 3,
+        root_offset, len(root), metadata_offset, len(metadata), leaves_offset, len(leaves), data_offset, len(data),
+        sum(entry[3] for entry in entries), len(entries), len(offsets),
+        # Clustered, gzipped directories, gzipped tiles, vector tiles
+        1, 2, 2, 1, min(zooms), max(zooms),
+        west, south, east, north,
+        min(zooms) + (max(zooms) - min(zooms)) * 3 // 4, (west + east) // 2, (south + north) // 2)
+    return header + root + metadata + leaves + bytes(data)
+
+
+# Page script drawing overlays from a PMTiles archive of the tiles, see nycOverlay in the shared geometry script.
+# Only the byte ranges of the tiles on screen are requested; a server that ignores
+# ranges sends the whole archive once, which is then read from memory.
+TILE_SCRIPT = """
+    // A tile's position in the archive: tiles of lower zooms, then along a Hilbert curve
+    function nycTileId(z, x, y) {
+        var id = (Math.pow(4, z) - 1) / 3;
+        for (var level = z - 1; level >= 0; level--) {
+            var side = 1 << level;
+            var rx = x & side ? 1 : 0, ry = y & side ? 1 : 0;
+            id += side * side * ((3 * rx) ^ ry);
+            x &= side - 1;
+            y &= side - 1;
+            if (ry === 0) {
+                if (rx === 1) {
+                    x = side - 1 - x;
+                    y = side - 1 - y;
+                }
+                var t = x;
+                x = y;
+                y = t;
+            }
+        }
+        return id;
+    }
+
+    function nycVarint(bytes, state) {
+        var value = 0, shift = 1, byte;
+        do {
+            byte = bytes[state.pos++];
+            value += (byte & 0x7f) * shift;
+            shift *= 128;
+        } while (byte >= 0x80);
+        return value;
+    }
+
+    function nycGunzip(buffer) {
+        return new Response(new Blob([buffer]).stream().pipeThrough(new DecompressionStream('gzip'))).arrayBuffer();
+    }
+
+    function nycDirectory(buffer) {
+        var bytes = new Uint8Array(buffer), state = {pos: 0};
+        var count = nycVarint(bytes, state), entries = [], id = 0, i;
+        for (i = 0; i < count; i++) {
+            id += nycVarint(bytes, state);
+            entries.push({tileId: id, offset: 0, length: 0, runLength: 0});
+        }
+        for (i = 0; i < count; i++) {
+            entries[i].runLength = nycVarint(bytes, state);
+        }
+        for (i = 0; i < count; i++) {
+            entries[i].length = nycVarint(bytes, state);
+        }
+        for (i = 0; i < count; i++) {
+            var offset = nycVarint(bytes, state);
+            entries[i].offset = offset === 0 && i > 0 ? entries[i - 1].offset + entries[i - 1].length : offset - 1;
+        }
+        return entries;
+    }
+
+    // Entry holding a tile, or the leaf directory that may, null when the archive has no such tile
+    function nycFindEntry(entries, id) {
+        var low = 0, high = entries.length - 1, found = null;
+        while (low <= high) {
+            var middle = (low + high) >> 1;
+            if (entries[middle].tileId <= id) {
+                found = entries[middle];
+                low = middle + 1;
+            } else {
+                high = middle - 1;
+            }
+        }
+        if (found && found.runLength > 0 && id >= found.tileId + found.runLength) {
+            return null;
+        }
+        return found;
+    }
+
+    // Reads the tiles of a PMTiles archive, each tile is fetched and decoded once
+    function nycOpenArchive(url) {
+        var whole = null;
+        function read(offset, length) {
+            if (whole) {
+                return Promise.resolve(whole.slice(offset, offset + length));
+            }
+            return fetch(url, {headers: {Range: 'bytes=' + offset + '-' + (offset + length - 1)}})
+                .then(function(response) {
+                    if (!response.ok) {
+                        throw new Error(response.status + ' ' + response.statusText);
+                    }
+                    return response.arrayBuffer().then(function(buffer) {
+                        if (response.status === 206) {
+                            return buffer;
+                        }
+                        whole = buffer;
+                        return buffer.slice(offset, offset + length);
+                    });
+                });
+        }
+        function uncompress(buffer, compression) {
+            return compression === 2 ? nycGunzip(buffer) : Promise.resolve(buffer);
+        }
+
+        var header = read(0, 16384).then(function(buffer) {
+            var view = new DataView(buffer);
+            function u64(offset) {
+                return view.getUint32(offset, true) + view.getUint32(offset + 4, true) * 4294967296;
+            }
+            if (new TextDecoder().decode(new Uint8Array(buffer, 0, 7)) !== 'PMTiles' || view.getUint8(7) !== 3) {
+                throw new Error(url + ' is not a version 3 PMTiles archive');
+            }
+            var archive = {
+                leafOffset: u64(40),
+                dataOffset: u64(56),
+                internalCompression: view.getUint8(97),
+                tileCompression: view.getUint8(98),
+                leaves: {}
+            };
+            return uncompress(buffer.slice(u64(8), u64(8) + u64(16)), archive.internalCompression)
+                .then(function(root) {
+                    archive.root = nycDirectory(root);
+                    return archive;
+                });
+        });
+
+        var tiles = {};
+        function tile(z, x, y) {
+            var id = nycTileId(z, x, y);
+            if (!tiles[id]) {
+                tiles[id] = header.then(function(archive) {
+                    function search(entries) {
+                        var entry = nycFindEntry(entries, id);
+                        if (!entry) {
+                            return null;
+                        }
+                        if (entry.runLength > 0) {
+                            return read(archive.dataOffset + entry.offset, entry.length)
+                                .then(function(buffer) {
+                                    return uncompress(buffer, archive.tileCompression);
+                                })
+                                .then(nycDecodeTile);
+                        }
+                        if (!archive.leaves[entry.offset]) {
+                            archive.leaves[entry.offset] = read(archive.leafOffset + entry.offset, entry.length)
+                                .then(function(buffer) {
+                                    return uncompress(buffer, archive.internalCompression);
+                                })
+                                .then(nycDirectory);
+                        }
+                        return archive.leaves[entry.offset].then(search);
+                    }
+                    return search(archive.root);
+                });
+                tiles[id].catch(function() {
+                    delete tiles[id];
+                });
+            }
+            return tiles[id];
+        }
+        return {tile: tile};
+    }
+
+    // {layer name: {extent, features: [{id, properties, rings}]}} of a Mapbox Vector Tile
+    function nycDecodeTile(buffer) {
+        var bytes = new Uint8Array(buffer);
+        var view = new DataView(buffer);
+        var text = new TextDecoder();
+        function message(start, end, each) {
+            var state = {pos: start};
+            while (state.pos < end) {
+                var tag = nycVarint(bytes, state), field = Math.floor(tag / 8), type = tag & 7, value;
+                if (type === 0) {
+                    value = nycVarint(bytes, state);
+                } else if (type === 1) {
+                    value = state.pos;
+                    state.pos += 8;
+                } else if (type === 2) {
+                    var length = nycVarint(bytes, state);
+                    value = [state.pos, state.pos + length];
+                    state.pos += length;
+                } else if (type === 5) {
+                    value = state.pos;
+                    state.pos += 4;
+                } else {
+                    throw new Error('Unsupported protobuf wire type ' + type);
+                }
+                each(field, type, value);
+            }
+        }
+        function packed(range) {
+            var values = [], state = {pos: range[0]};
+            while (state.pos < range[1]) {
+                values.push(nycVarint(bytes, state));
+            }
+            return values;
+        }
+        function string(range) {
+            return text.decode(bytes.subarray(range[0], range[1]));
+        }
+        function decodeValue(range) {
+            var result = null;
+            message(range[0], range[1], function(field, type, value) {
+                if (field === 1) {
+                    result = string(value);
+                } else if (field === 2) {
+                    result = view.getFloat32(value, true);
+                } else if (field === 3) {
+                    result = view.getFloat64(value, true);
+                } else if (field === 6) {
+                    result = value % 2 ? -(value + 1) / 2 : value / 2;
+                } else if (field === 7) {
+                    result = value === 1;
+                } else {
+                    result = value;
+                }
+            });
+            return result;
+        }
+        function rings(commands) {
+            var result = [], ring = null, x = 0, y = 0;
+            for (var i = 0; i < commands.length;) {
+                var command = commands[i] & 7, count = Math.floor(commands[i] / 8);
+                i++;
+                if (command === 7) {
+                    continue;
+                }
+                for (var n = 0; n < count; n++) {
+                    var dx = commands[i++], dy = commands[i++];
+                    x += dx % 2 ? -(dx + 1) / 2 : dx / 2;
+                    y += dy % 2 ? -(dy + 1) / 2 : dy / 2;
+                    if (command === 1) {
+                        ring = [];
+                        result.push(ring);
+                    }
+                    ring.push([x, y]);
+                }
+            }
+            return result;
+        }
+
+        var layers = {};
+        message(0, bytes.length, function(field, type, range) {
+            if (field !== 3) {
+                return;
+            }
+            var layer = {name: '', extent: 4096, keys: [], values: [], features: []};
+            message(range[0], range[1], function(field, type, value) {
+                if (field === 1) {
+                    layer.name = string(value);
+                } else if (field === 2) {
+                    layer.features.push(value);
+                } else if (field === 3) {
+                    layer.keys.push(string(value));
+                } else if (field === 4) {
+                    layer.values.push(decodeValue(value));
+                } else if (field === 5) {
+                    layer.extent = value;
+                }
+            });
+            layer.features = layer.features.map(function(range) {
+                var feature = {id: 0, properties: {}, rings: []};
+                message(range[0], range[1], function(field, type, value) {
+                    if (field === 1) {
+                        feature.id = value;
+                    } else if (field === 2) {
+                        var tags = packed(value);
+                        for (var i = 0; i < tags.length; i += 2) {
+                            feature.properties[layer.keys[tags[i]]] = layer.values[tags[i + 1]];
+                        }
+                    } else if (field === 4) {
+                        feature.rings = rings(packed(value));
+                    }
+                });
+                return feature;
+            });
+            layers[layer.name] = layer;
+        });
+        return layers;
+    }
+
+    // Canvas tiles of one layer of the archive, painted with the style of the overlay showing them.
+    // Zooms past the archive's last one are drawn from its tiles, scaled up.
+    var nycTileLayerClass = null;
+    var nycTileReader = null;
+
+    function nycTileLayer(name, options, style) {
+        if (!nycTileLayerClass) {
+            nycTileLayerClass = L.GridLayer.extend({
+                createTile: function(coords, done) {
+                    var canvas = L.DomUtil.create('canvas', 'leaflet-tile');
+                    var size = this.getTileSize(), ratio = window.devicePixelRatio || 1;
+                    canvas.width = size.x * ratio;
+                    canvas.height = size.y * ratio;
+                    var layer = this;
+                    var scale = Math.pow(2, Math.max(0, coords.z - nycTiles.maxZoom));
+                    var x = Math.floor(coords.x / scale), y = Math.floor(coords.y / scale);
+                    nycTileReader.tile(Math.min(coords.z, nycTiles.maxZoom), x, y).then(function(layers) {
+                        canvas.nycTile = {
+                            layer: layers && layers[layer.nycName],
+                            scale: scale,
+                            x: coords.x - x * scale,
+                            y: coords.y - y * scale
+                        };
+                        layer.drawTile(canvas);
+                        done(null, canvas);
+                    }, function(error) {
+                        console.error('Could not load a ' + layer.nycName + ' tile from ' + nycTiles.url, error);
+                        done(error, canvas);
+                    });
+                    return canvas;
+                },
+                drawTile: function(canvas) {
+                    var tile = canvas.nycTile;
+                    var context = canvas.getContext('2d');
+                    context.setTransform(1, 0, 0, 1, 0, 0);
+                    context.clearRect(0, 0, canvas.width, canvas.height);
+                    // A tile can arrive after its overlay was switched off, it is painted when one is shown again
+                    if (!tile || !tile.layer || !this._map || !this.nycOverlay) {
+                        return;
+                    }
+                    var factor = canvas.width * tile.scale / tile.layer.extent;
+                    context.setTransform(factor, 0, 0, factor, -tile.x * canvas.width, -tile.y * canvas.height);
+                    var style = this.nycStyle;
+                    tile.layer.features.forEach(function(feature) {
+                        var options = L.extend({color: '#3388ff', weight: 3, opacity: 1, fillOpacity: 0.2},
+                                               style(feature));
+                        context.beginPath();
+                        feature.rings.forEach(function(ring) {
+                            context.moveTo(ring[0][0], ring[0][1]);
+                            for (var i = 1; i < ring.length; i++) {
+                                context.lineTo(ring[i][0], ring[i][1]);
+                            }
+                            context.closePath();
+                        });
+                        if (options.fill !== false) {
+                            context.globalAlpha = options.fillOpacity;
+                            context.fillStyle = options.fillColor || options.color;
+                            context.fill();
+                        }
+                        if (options.stroke !== false && options.weight > 0 && options.opacity > 0) {
+                            context.globalAlpha = options.opacity;
+                            context.strokeStyle = options.color;
+                            context.lineWidth = options.weight * (window.devicePixelRatio || 1) / factor;
+                            context.stroke();
+                        }
+                    });
+                },
+                // Repaint the tiles already loaded, the overlay's style function has changed
+                setStyle: function() {
+                    for (var key in this._tiles) {
+                        this.drawTile(this._tiles[key].el);
+                    }
+                    return this;
+                }
+            });
+        }
+        nycTileReader = nycTileReader || nycOpenArchive(nycTiles.url);
+        var layer = new nycTileLayerClass({
+            pane: options.pane || 'overlayPane',
+            minNativeZoom: nycTiles.minZoom
+        });
+        layer.nycName = name;
+        layer.nycStyle = style;
+        return layer;
+    }
+"""